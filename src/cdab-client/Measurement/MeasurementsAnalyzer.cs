@@ -39,6 +39,9 @@ namespace cdabtesttools.Measurement
     {
         private static ILog log = LogManager.GetLogger(typeof(MeasurementsAnalyzer));
 
+        // Relative accuracy of the response time histograms (must be the same as in the cdab-remote-client)
+        private const double HistogramRelativeAccuracy = 0.01;
+
         public static TestCaseResult GenerateTestCaseResult(TestCase testCase, IEnumerable<MetricName> metricsToAnalyze, long tasksCount)
         {
 
@@ -103,6 +106,15 @@ namespace cdabtesttools.Measurement
                 metrics.Add(_peakResponseTime);
             }
 
+            if (metricsToAnalyze.Contains(MetricName.avgResponseTime) && results.SelectMany(r => r.Metrics).Where(m => m.Name == MetricName.responseTime).Count() > 0)
+            {
+                LongArrayMetric _responseTimeHistogram = new LongArrayMetric(MetricName.responseTimeHistogram,
+                    GetHistogram(results.SelectMany(r => r.Metrics).Where(m => m.Name == MetricName.responseTime).Cast<LongMetric>().Select(m => m.Value)),
+                     "ms");
+                log.DebugFormat("Response Time Histogram : {0}", string.Join(",", _responseTimeHistogram.Value));
+                metrics.Add(_responseTimeHistogram);
+            }
+
             if (metricsToAnalyze.Contains(MetricName.errorRate))
             {
                 double _totalErrors = 0;
@@ -280,6 +292,23 @@ namespace cdabtesttools.Measurement
             return _tcr;
         }
 
+        /// <summary>
+        /// Builds a histogram of values with logarithmic buckets that can be merged with the histograms of other
+        /// test runs (and test cases) to obtain percentiles with a bounded relative error.
+        /// Bucket i contains the values v with gamma^(i-1) &lt; v &lt;= gamma^i, where gamma = (1 + a) / (1 - a)
+        /// for the relative accuracy a; values below 1 are in bucket -1.
+        /// </summary>
+        /// <returns>The histogram as pairs of bucket index and count, sorted by bucket index.</returns>
+        internal static long[] GetHistogram(IEnumerable<long> values)
+        {
+            double gamma = (1 + HistogramRelativeAccuracy) / (1 - HistogramRelativeAccuracy);
+            return values
+                .GroupBy(v => v < 1 ? -1 : (long)Math.Ceiling(Math.Log(v) / Math.Log(gamma)))
+                .OrderBy(g => g.Key)
+                .SelectMany(g => new long[] { g.Key, g.LongCount() })
+                .ToArray();
+        }
+
         internal static TestCaseResult GenerateTestCase501Result(TestCase501 testCase501)
         {
             List<IMetric> metrics = new List<IMetric>();
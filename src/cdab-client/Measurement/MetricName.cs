@@ -92,5 +92,6 @@ namespace cdabtesttools.Measurement
         endGetResponseTime,
         downloadElapsedTime,
         offlineDataAvailabilityLatency,
+        responseTimeHistogram,
     }
 }
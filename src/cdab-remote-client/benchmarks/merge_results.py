@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+
+# Measures the merge of remote test results (ResultMerger) on synthetic TestResult-remote*.json
+# files and compares it with the former approach (all files loaded, one scan over all nodes per
+# test case and over all metrics per metric name), checking that both produce the same result.
+#
+# Usage: python3 merge_results.py [-runs <number>] [-cases <number>] [-metrics <number>] [-division <number>]
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "libexec"))
+
+from cdab_results import *
+
+MAIN_TEST_NAME = "TC301"
+
+
+
+def create_result_file(file_name, run_index, case_count, metric_count, division_size):
+    """Writes a synthetic result file similar to those produced by cdab-client.
+    """
+    test_cases = []
+    for c in range(case_count):
+        metrics = [
+            { 'name': "avgResponseTime", 'value': random.randint(100, 5000), 'uom': "ms" },
+            { 'name': "errorRate", 'value': random.random() * 10, 'uom': "%" },
+            { 'name': "peakResponseTime", 'value': random.randint(5000, 20000), 'uom': "ms" },
+            { 'name': "totalReadResults", 'value': random.randint(0, 1000), 'uom': "#" },
+            { 'name': "dataCollectionDivision", 'value': [ "collection-{0}".format(random.randint(0, 100)) for i in range(division_size) ], 'uom': "string" },
+        ]
+        metrics.extend([ { 'name': "metric{0}".format(m), 'value': random.randint(0, 100), 'uom': "#" } for m in range(metric_count) ])
+        test_case = {
+            'testName': "{0}{1:03d}".format("TC" if c % 2 else "", 101 + c),
+            'className': "cdabtesttools.TestCases.TestCase{0:03d}".format(101 + c),
+            'startedAt': "2023-01-01T00:{0:02d}:00Z".format(run_index % 60),
+            'endedAt': "2023-01-01T01:{0:02d}:00Z".format(run_index % 60),
+            'duration': random.randint(1000, 100000),
+            'metrics': metrics,
+        }
+        # Search filters and other attributes only in some test cases and test runs
+        if c % 3 != 2:
+            test_case['searchFiltersDefinition'] = [ { 'key': "filter", 'value': "run {0}".format(run_index) } ]
+        if c % 3 == 1 and run_index % 2 == 0:
+            test_case['processingStatus'] = { 'run': run_index, 'status': "completed" }
+        test_cases.append(test_case)
+    test_cases.append({ 'testName': MAIN_TEST_NAME, 'metrics': [ { 'name': "errorRate", 'value': 0.0, 'uom': "%" } ] })
+
+    with open(file_name, 'w') as file:
+        json.dump({ 'testTargetUrl': "https://catalogue.example.com", 'testCaseResults': test_cases }, file)
+
+
+
+def get_average(l, decimals=0):
+    if len(l) == 0:
+        return "N/A"
+    for i in l:
+        if not isinstance(i, int) and not isinstance(i, float):
+            return "N/A"
+    result = sum(l) / len(l)
+    if (decimals == 0):
+        return int(round(result))
+    else:
+        return round(result, decimals)
+
+
+
+def merge_naive(file_names):
+    """The former merge algorithm of produce_metrics, for comparison. The code is copied verbatim,
+    except that the given files are read instead of those of the test runs (without extracting
+    the run-specific values of the main test case) and that get_average replaces TestClient.get_average.
+    """
+    test_target_url = None
+
+    # Read remote test results JSON files (copy testCaseResults nodes)
+    all_test_case_nodes = []
+    test_case_nodes = []
+    for file_name in file_names:
+        with open(file_name, 'r') as file:
+            result_file = json.loads(file.read())
+            if test_target_url is None and 'testTargetUrl' in result_file and result_file['testTargetUrl']:
+                test_target_url = result_file['testTargetUrl']
+
+            for test_case_result_node in result_file['testCaseResults']:
+                if 'testName' in test_case_result_node and 'metrics' in test_case_result_node and test_case_result_node['testName'] == MAIN_TEST_NAME:
+                    continue   # don't add main test case of test scenario
+
+                all_test_case_nodes.append(test_case_result_node)
+
+    aggregate_functions = {
+        'avgResponseTime': lambda l: get_average(l),
+        'errorRate': lambda l: get_average(l, 2),
+        'avgConcurrency': sum,
+        'avgSize': lambda l: get_average(l),
+        'resultsErrorRate': lambda l: get_average(l, 2),
+        'peakResponseTime': max,
+        'maxSize': max,
+        'peakConcurrency': sum,
+        'maxTotalResults': max,
+        'totalReadResults': sum,
+        'totalSize': sum,
+        'throughput': sum,
+        'dataCollectionDivision': lambda l: [i for l1 in l for i in l1],
+        'processCount': sum,
+        'avgProcessDuration': lambda l: get_average(l),
+    }
+
+    # List of remote test cases (unique entries)
+    test_cases = sorted(set([ t['testName'] for t in all_test_case_nodes ]))
+
+    for test_case in test_cases:
+        orig_nodes = [ t for t in all_test_case_nodes if t['testName'] == test_case ]
+        test_name = test_case if test_case.startswith('TC') else "TC{0}".format(test_case)
+        merged_node = { 'testName': test_name }
+        merged_node['className'] = next(t['className'] for t in orig_nodes if 'className' in t)
+        seq = [t['startedAt'] for t in orig_nodes if 'startedAt' in t and t['startedAt']]
+        merged_node['startedAt'] = min(seq) if seq else None
+        seq = [t['endedAt'] for t in orig_nodes if 'endedAt' in t and t['endedAt']]
+        merged_node['endedAt'] = max(seq) if seq else None
+        durations = [t['duration'] for t in orig_nodes if 'duration' in t]
+        merged_node['duration'] = int(round(sum(durations) / len(durations)))
+
+        merged_node['metrics'] = []
+        metric_names = []
+        for t in orig_nodes:
+            for m in t['metrics']:
+                if m['name'] not in metric_names:
+                    metric_names.append(m['name'])
+        for metric_name in metric_names:
+            metrics = [ m for t in orig_nodes for m in t['metrics'] if m['name'] == metric_name ]
+            merged_metric = metrics[0].copy()
+            if metric_name in aggregate_functions:
+                merged_metric['value'] = aggregate_functions[metric_name]([m['value'] for m in metrics])
+            merged_node['metrics'].append(merged_metric)
+
+        search_filters = [ s for t in orig_nodes if 'searchFiltersDefinition' in t and t['searchFiltersDefinition'] for s in t['searchFiltersDefinition'] ]
+        if search_filters:
+            merged_node['searchFiltersDefinition'] = search_filters
+
+        other_node_names = []
+        for t in orig_nodes:
+            for k in t:
+                if k not in ['testName', 'className', 'startedAt', 'endedAt', 'duration', 'metrics', 'searchFiltersDefinition' ] and k not in other_node_names:
+                    other_node_names.append(k)
+
+        for other_node_name in other_node_names:
+            nodes = [ t[other_node_name] for t in orig_nodes if other_node_name in t ]
+            merged_node[other_node_name] = nodes
+
+        test_case_nodes.append(merged_node)
+
+    return test_case_nodes
+
+
+
+def merge(file_names):
+    merger = ResultMerger(MAIN_TEST_NAME)
+    for file_name in file_names:
+        merger.add_file(file_name)
+    return merger.get_test_case_nodes()
+
+
+
+def measure(function, file_names):
+    """Returns the result, the duration (in ms) and the peak memory allocation (in MB) of a merge
+    (measured in a second execution, as the memory tracing slows it down).
+    """
+    start_time = time.perf_counter()
+    result = function(file_names)
+    duration = (time.perf_counter() - start_time) * 1000
+
+    tracemalloc.start()
+    function(file_names)
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+
+def main():
+    settings = { '-runs': 50, '-cases': 10, '-metrics': 20, '-division': 200 }
+    args = sys.argv[1:]
+    while len(args) >= 2 and args[0] in settings:
+        settings[args[0]] = int(args[1])
+        args = args[2:]
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        file_names = []
+        for r in range(settings['-runs']):
+            file_name = os.path.join(temp_dir, "TestResult-remote-{0}.json".format(r + 1))
+            create_result_file(file_name, r, settings['-cases'], settings['-metrics'], settings['-division'])
+            file_names.append(file_name)
+        total_size = sum([ os.path.getsize(f) for f in file_names ]) / 1024 / 1024
+
+        print("{0} files, {1:.1f} MB in total, ijson {2}".format(len(file_names), total_size, "available" if ijson else "not available"))
+
+        naive_result, naive_duration, naive_peak = measure(merge_naive, file_names)
+        print("{0:<25} {1:>10.1f} ms {2:>10.1f} MB peak".format("former merge", naive_duration, naive_peak))
+
+        result, duration, peak = measure(merge, file_names)
+        print("{0:<25} {1:>10.1f} ms {2:>10.1f} MB peak".format("ResultMerger", duration, peak))
+
+        if result != naive_result:
+            print("ERROR: results differ", file=sys.stderr)
+            sys.exit(1)
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+# Measures the startup time of cdab-remote-client, i.e. the time of a complete invocation
+# that does not need to contact any cloud (usage output), and the additional import time of
+# each connector module with the cloud SDK it depends on.
+#
+# Usage: python3 startup_time.py [-n <repetitions>]
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+LIBEXEC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "libexec")
+CLIENT_SCRIPT = os.path.join(LIBEXEC_DIR, "cdab-remote-client.py3")
+CONNECTOR_MODULES = ['connectors.openstack', 'connectors.google', 'connectors.amazon', 'connectors.azure']
+
+
+
+def time_command(command, repetitions):
+    """Runs the command repeatedly and returns the median wall-clock duration in milliseconds,
+    or None if the command fails.
+    """
+
+    durations = []
+    for i in range(repetitions):
+        start_time = time.perf_counter()
+        result = subprocess.run(command, cwd=LIBEXEC_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            return None
+        durations.append((time.perf_counter() - start_time) * 1000)
+
+    return statistics.median(durations)
+
+
+
+def main():
+    repetitions = 5
+    if len(sys.argv) == 3 and sys.argv[1] == '-n':
+        repetitions = int(sys.argv[2])
+
+    baseline = time_command([sys.executable, "-c", "pass"], repetitions)
+    print("{0:<40} {1:>10.1f} ms".format("python interpreter", baseline))
+
+    duration = time_command([sys.executable, CLIENT_SCRIPT, "-h"], repetitions)
+    print("{0:<40} {1:>10.1f} ms".format("cdab-remote-client -h", duration))
+
+    for module_name in CONNECTOR_MODULES:
+        duration = time_command([sys.executable, "-c", "import {0}".format(module_name)], repetitions)
+        if duration is None:
+            print("{0:<40} {1:>13}".format("import " + module_name, "unavailable"))
+        else:
+            print("{0:<40} {1:>10.1f} ms".format("import " + module_name, duration - baseline))
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+from cdab_shared import *
+import base64
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import os
+import shlex
+import tarfile
+import time
+
+
+
+class Bootstrap:
+    """Provisioning steps for the virtual machine of a test run, rendered into a single bundle.
+
+    The bundle is a gzip-compressed tar file that contains a bash script (bootstrap.sh) with all
+    steps and a directory (files) with all files needed by the steps. It is transferred to the
+    virtual machine with a single scp call and executed with a single ssh call. The script
+    reports the start and end time and the exit code of every step as JSON on its standard output;
+    the output of the steps themselves is written to a log file next to the script.
+
+    Each step belongs to a stage, so that the stages can be executed separately
+    (e.g. the software installation before the test-specific setup).
+
+    If cloud-init is used, the steps marked accordingly are also rendered into a user data
+    script, which is passed to the virtual machine at creation and runs while the
+    virtual machine boots. The bootstrap script then waits for that script to finish and skips
+    those steps, unless the user data script failed or did not run.
+
+    Persistent steps leave a marker in a state directory on the virtual machine when they succeed,
+    so that they are skipped when the bundle is executed again on the same virtual machine
+    (e.g. one leased from the warm pool). The marker name contains a hash of the step's commands
+    and files, so that a changed step is executed again.
+    """
+
+    BUNDLE_DIR = "cdab-bootstrap"
+    LOG_FILE = "bootstrap.log"
+    FILES_DIR = "files"
+
+    STAGE_CLOUD_INIT = "cloud-init"
+    STAGE_INSTALL = "install"
+    STAGE_SETUP = "setup"
+
+    # Location of the files and the status file written by the user data script on the virtual machine
+    CLOUD_INIT_DIR = "/var/lib/cdab-bootstrap"
+
+    # Maximum time (in seconds) to wait for the user data script if cloud-init is not installed
+    # (e.g. Google Compute Engine images, where the startup script is run by the guest agent)
+    CLOUD_INIT_TIMEOUT = 1800
+
+    # Number of lines at the end of the bootstrap log shown in case of a failed step
+    LOG_TAIL_LINES = 50
+
+    # Directory (relative to the remote user's home directory) with the markers of completed persistent steps
+    STATE_DIR = ".cdab-bootstrap-state"
+
+
+    def __init__(self, cloud_init=False):
+        """Creates an empty bootstrap.
+
+        Parameters
+        ----------
+        cloud_init : bool
+            Whether the steps marked for cloud-init are run by a user data script
+            at virtual machine creation (default: False).
+        """
+        self.cloud_init = cloud_init
+        self.steps = []
+        self.files = []
+
+
+
+    def add_step(self, name, commands, stage=STAGE_INSTALL, cloud_init=False, persistent=False):
+        """Adds a provisioning step.
+
+        Parameters
+        ----------
+        name : str
+            The name of the step (used in the log and in the timing information).
+        commands : list of str
+            The shell commands of the step; they are run with "set -e", so the step
+            fails at the first command with a non-zero exit code.
+            Files added to the bundle are referenced via "$FILES/<name>".
+        stage : str
+            The stage the step belongs to (default: install).
+        cloud_init : bool
+            Whether the step can run as root in the user data script at virtual machine creation
+            (default: False). Such steps must not depend on the remote user, on attached volumes or
+            on confidential files, as the user data can be read by anyone with access to the
+            cloud project.
+        persistent : bool
+            Whether the effect of the step outlasts the test run (e.g. installed software), so that
+            the step is skipped if it has already been completed on the virtual machine (default: False).
+        """
+        self.steps.append({'name': name, 'commands': commands, 'stage': stage, 'cloud_init': cloud_init, 'persistent': persistent})
+
+
+
+    def add_file(self, local_file, name=None):
+        """Adds a local file to the bundle.
+
+        Parameters
+        ----------
+        local_file : str
+            The path to the local file.
+        name : str
+            The file name within the bundle (default: the base name of the local file).
+
+        Returns
+        -------
+        str
+            The path of the file on the virtual machine for use in the step commands.
+        """
+        if name is None:
+            name = os.path.basename(local_file)
+        self.files.append((name, local_file, None))
+        return "$FILES/{0}".format(name)
+
+
+
+    def add_content(self, name, content):
+        """Adds a file with the given content to the bundle (e.g. a generated configuration file).
+
+        Parameters
+        ----------
+        name : str
+            The file name within the bundle.
+        content : str
+            The content of the file.
+
+        Returns
+        -------
+        str
+            The path of the file on the virtual machine for use in the step commands.
+        """
+        self.files.append((name, None, content.encode('utf-8')))
+        return "$FILES/{0}".format(name)
+
+
+
+    def render_script(self):
+        """Renders the bootstrap script from the provisioning steps.
+
+        The script takes the stages to be executed as arguments (all stages if no argument is given).
+        It always exits with code 0; a failed step is reported in the JSON output and the subsequent
+        steps are skipped.
+
+        Returns
+        -------
+        str
+            The content of the bootstrap script.
+        """
+
+        lines = [
+            "# Bootstrap script generated by cdab-remote-client",
+            "",
+            "BUNDLE=$(cd $(dirname $0) && pwd)",
+            "FILES=$BUNDLE/{0}".format(Bootstrap.FILES_DIR),
+            "LOG=$BUNDLE/{0}".format(Bootstrap.LOG_FILE),
+            "STAGES=\" ${*:-all} \"",
+            "CLOUD_INIT_STATUS={0}/status.json".format(Bootstrap.CLOUD_INIT_DIR),
+            "CLOUD_INIT=\"\"",
+            "STATE_DIR=$HOME/{0}".format(Bootstrap.STATE_DIR),
+            "",
+        ]
+        lines.extend(self.render_step_functions(self.steps))
+
+        if self.cloud_init and self.get_cloud_init_steps():
+            # Waiting for the user data script is a step of its own; if the user data script did not
+            # complete successfully, the steps it contains are executed as part of this script
+            lines.extend([
+                "wait_for_cloud_init() {",
+                "    if command -v cloud-init > /dev/null; then",
+                "        sudo cloud-init status --wait > /dev/null || true",
+                "    else",
+                "        local end_time=$(( $(date +%s) + {0} ))".format(Bootstrap.CLOUD_INIT_TIMEOUT),
+                "        while [ ! -f \"$CLOUD_INIT_STATUS\" ] && [ $(date +%s) -lt $end_time ]; do sleep 1; done",
+                "    fi",
+                "    cat \"$CLOUD_INIT_STATUS\"",
+                "    grep -q '\"failed\": \"\"' \"$CLOUD_INIT_STATUS\"",
+                "}",
+                "",
+                "run_step {0} wait_for_cloud_init wait_for_cloud_init optional".format(Bootstrap.STAGE_INSTALL),
+                "# (also if the install stage has been executed separately before)",
+                "[ -f \"$CLOUD_INIT_STATUS\" ] && grep -q '\"failed\": \"\"' \"$CLOUD_INIT_STATUS\" && CLOUD_INIT=done",
+            ])
+
+        lines.extend(self.render_step_calls(self.steps))
+
+        lines.extend([
+            "",
+            "[ -f \"$CLOUD_INIT_STATUS\" ] && CLOUD_INIT_RESULT=$(cat \"$CLOUD_INIT_STATUS\") || CLOUD_INIT_RESULT=null",
+            "echo \"{\\\"steps\\\": [$STEPS], \\\"failed\\\": \\\"$FAILED\\\", \\\"cloudInit\\\": $CLOUD_INIT_RESULT, \\\"now\\\": $(date +%s%N)}\"",
+            "exit 0",
+            "",
+        ])
+
+        return "\n".join(lines)
+
+
+
+    def render_user_data(self):
+        """Renders the user data script (for cloud-init or equivalent mechanisms) containing the steps
+        marked for cloud-init and the files they use. The script writes the timing information
+        of the steps as JSON to a status file, which is read by the bootstrap script.
+
+        Returns
+        -------
+        str
+            The content of the user data script, or None if cloud-init is not used
+            or there are no steps to be run by it.
+        """
+
+        steps = self.get_cloud_init_steps()
+        if not self.cloud_init or not steps:
+            return None
+
+        lines = [
+            "#!/bin/bash",
+            "# User data script generated by cdab-remote-client",
+            "",
+            "BUNDLE={0}".format(Bootstrap.CLOUD_INIT_DIR),
+            "FILES=$BUNDLE/{0}".format(Bootstrap.FILES_DIR),
+            "LOG=$BUNDLE/{0}".format(Bootstrap.LOG_FILE),
+            "STAGES=\" all \"",
+            "CLOUD_INIT=\"\"",
+            "export DEBIAN_FRONTEND=noninteractive",
+            "",
+            "mkdir -p $FILES",
+        ]
+
+        # The files used by the steps are embedded (compressed)
+        for (name, local_file, content) in self.files:
+            reference = "$FILES/{0}".format(name)
+            if not [ s for s in steps if [ c for c in s['commands'] if reference in c ] ]:
+                continue
+            content = self.get_file_content(local_file, content)
+            lines.append("mkdir -p $(dirname {0})".format(reference))
+            lines.append("base64 -d << 'CDAB_EOF' | gunzip > {0}".format(reference))
+            lines.append(base64.encodebytes(gzip.compress(content)).decode('ascii').rstrip("\n"))
+            lines.append("CDAB_EOF")
+
+        lines.append("")
+        lines.extend(self.render_step_functions(steps))
+        lines.extend(self.render_step_calls(steps, False, False))
+        lines.extend([
+            "",
+            "echo \"{\\\"steps\\\": [$STEPS], \\\"failed\\\": \\\"$FAILED\\\"}\" > $BUNDLE/status.json.tmp",
+            "mv $BUNDLE/status.json.tmp $BUNDLE/status.json",
+            "",
+        ])
+
+        return "\n".join(lines)
+
+
+
+    def get_cloud_init_steps(self):
+        return [ s for s in self.steps if s['cloud_init'] ]
+
+
+
+    def render_step_functions(self, steps):
+        """Returns the lines of the function that runs and times a step (run_step) and
+        of one function per step containing the step's commands.
+        """
+
+        lines = [
+            "STEPS=\"\"",
+            "FAILED=\"\"",
+            "",
+            "# Arguments: stage, step name, function, flag (cloud_init: skipped if done by cloud-init; optional: failure does not stop the bootstrap),",
+            "# marker (persistent steps: skipped if the marker exists in the state directory, created on success)",
+            "run_step() {",
+            "    local stage=\"$1\" name=\"$2\" function=\"$3\" flag=\"$4\" marker=\"$5\"",
+            "    case \"$STAGES\" in",
+            "        *\" all \"*|*\" $stage \"*) ;;",
+            "        *) return 0 ;;",
+            "    esac",
+            "    [ -n \"$FAILED\" ] && return 0",
+            "    [ \"$flag\" = cloud_init ] && [ -n \"$CLOUD_INIT\" ] && return 0",
+            "    [ -n \"$marker\" ] && [ -f \"$STATE_DIR/$marker\" ] && echo \"===== $name (already completed)\" >> \"$LOG\" && return 0",
+            "    echo \"===== $name ($(date -u +%Y-%m-%dT%H:%M:%SZ))\" >> \"$LOG\"",
+            "    local start_time=$(date +%s%N)",
+            "    ( set -e; $function ) < /dev/null >> \"$LOG\" 2>&1",
+            "    LAST_EXIT_CODE=$?",
+            "    local end_time=$(date +%s%N)",
+            "    [ -n \"$STEPS\" ] && STEPS=\"$STEPS, \"",
+            "    STEPS=\"$STEPS{\\\"name\\\": \\\"$name\\\", \\\"stage\\\": \\\"$stage\\\", \\\"startTime\\\": $start_time, \\\"endTime\\\": $end_time, \\\"exitCode\\\": $LAST_EXIT_CODE}\"",
+            "    [ $LAST_EXIT_CODE -eq 0 ] || [ \"$flag\" = optional ] || FAILED=\"$name\"",
+            "    [ $LAST_EXIT_CODE -eq 0 ] && [ -n \"$marker\" ] && mkdir -p \"$STATE_DIR\" && touch \"$STATE_DIR/$marker\"",
+            "}",
+            "",
+        ]
+
+        for step in steps:
+            lines.append("step_{0}() {{".format(self.steps.index(step) + 1))
+            for command in step['commands']:
+                lines.append("    {0}".format(command))
+            lines.append("}")
+            lines.append("")
+
+        return lines
+
+
+
+    def render_step_calls(self, steps, skip_cloud_init_steps=True, use_markers=True):
+        lines = []
+        for step in steps:
+            marker = self.get_step_marker(step) if use_markers and step['persistent'] else None
+            lines.append("run_step {0} {1} step_{2}{3}{4}".format(
+                shlex.quote(step['stage']),
+                shlex.quote(step['name']),
+                self.steps.index(step) + 1,
+                " cloud_init" if skip_cloud_init_steps and step['cloud_init'] else (" -" if marker else ""),
+                " {0}".format(marker) if marker else ""
+            ))
+        return lines
+
+
+
+    def get_step_marker(self, step):
+        """Returns the name of the marker of a persistent step, which depends on
+        the step's commands and on the content of the files they reference.
+        """
+        digest = hashlib.sha1()
+        for command in step['commands']:
+            digest.update(command.encode('utf-8'))
+            digest.update(b"\n")
+        for (name, local_file, content) in self.files:
+            if [ c for c in step['commands'] if "$FILES/{0}".format(name) in c ]:
+                digest.update(self.get_file_content(local_file, content))
+        return "{0}-{1}".format(step['name'], digest.hexdigest()[0:12])
+
+
+
+    def get_file_content(self, local_file, content):
+        if local_file:
+            with open(local_file, 'rb') as f:
+                return f.read()
+        return content
+
+
+
+    def write_bundle(self, bundle_file):
+        """Writes the bundle (script and files) as gzip-compressed tar file.
+
+        Parameters
+        ----------
+        bundle_file : str
+            The path of the local bundle file.
+        """
+        with tarfile.open(bundle_file, 'w:gz') as tar:
+            self.add_tar_member(tar, "bootstrap.sh", self.render_script().encode('utf-8'))
+            for (name, local_file, content) in self.files:
+                if local_file:
+                    tar.add(local_file, arcname="{0}/{1}".format(Bootstrap.FILES_DIR, name))
+                else:
+                    self.add_tar_member(tar, "{0}/{1}".format(Bootstrap.FILES_DIR, name), content)
+
+
+
+    def add_tar_member(self, tar, name, content):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mtime = time.time()
+        info.mode = 0o644
+        tar.addfile(info, io.BytesIO(content))
+
+
+
+    def upload(self, compute_config, run, bundle_file):
+        """Transfers the bundle to the virtual machine and unpacks it.
+
+        Parameters
+        ----------
+        compute_config : dict
+            A dict object containing information taken from the compute node of a
+            service provider configuration in the configuration YAML file.
+        run : TestRun
+            The test run object encapsulating all information for the individual test run.
+        bundle_file : str
+            The path of the local bundle file.
+        """
+        self.write_bundle(bundle_file)
+        try:
+            copy_file(compute_config, run, bundle_file, "{0}.tgz".format(Bootstrap.BUNDLE_DIR))
+        finally:
+            os.remove(bundle_file)
+
+        execute_remote_command(
+            compute_config,
+            run,
+            "rm -rf {0} && mkdir {0} && tar xzf {0}.tgz -C {0} && rm {0}.tgz".format(Bootstrap.BUNDLE_DIR)
+        )
+
+
+
+    def execute(self, compute_config, run, stages=None):
+        """Runs the bootstrap script of the uploaded bundle on the virtual machine for the given stages.
+        The stages can be executed in separate calls.
+
+        The timing information of the executed steps is added to the run's list of
+        bootstrap steps (run.bootstrap_steps); the remote times are converted to local times
+        based on the time reported by the virtual machine at the end of the script.
+
+        Parameters
+        ----------
+        compute_config : dict
+            A dict object containing information taken from the compute node of a
+            service provider configuration in the configuration YAML file.
+        run : TestRun
+            The test run object encapsulating all information for the individual test run.
+        stages : list of str
+            The stages to be executed (default: None, i.e. all stages).
+
+        Returns
+        -------
+        list of dict
+            The executed steps with name, stage, start and end time and exit code.
+        """
+
+        command = "bash {0}/bootstrap.sh {1}".format(
+            Bootstrap.BUNDLE_DIR,
+            " ".join(stages) if stages else ""
+        )
+        result = execute_remote_command(compute_config, run, command, json_output=True)
+        received_time = datetime.datetime.utcnow()
+
+        # The user data script is only reported together with the install stage
+        report_cloud_init = not stages or Bootstrap.STAGE_INSTALL in stages
+
+        remote_steps = result['steps']
+        if report_cloud_init and result['cloudInit']:
+            # The steps run by the user data script are reported with a stage of their own
+            for step in result['cloudInit']['steps']:
+                step['stage'] = Bootstrap.STAGE_CLOUD_INIT
+            remote_steps = result['cloudInit']['steps'] + remote_steps
+            if result['cloudInit']['failed']:
+                Logger.log(LogLevel.WARN, "User data script failed at step '{0}', steps repeated by bootstrap script".format(result['cloudInit']['failed']), run=run)
+        elif report_cloud_init and self.cloud_init and self.get_cloud_init_steps():
+            Logger.log(LogLevel.WARN, "User data script not executed, steps run by bootstrap script", run=run)
+
+        steps = []
+        for step in remote_steps:
+            step_info = {
+                'name': step['name'],
+                'stage': step['stage'],
+                'startTime': received_time - datetime.timedelta(microseconds=(result['now'] - step['startTime']) / 1000),
+                'endTime': received_time - datetime.timedelta(microseconds=(result['now'] - step['endTime']) / 1000),
+                'exitCode': step['exitCode'],
+            }
+            step_info['duration'] = int((step_info['endTime'] - step_info['startTime']).total_seconds() * 1000)
+            steps.append(step_info)
+            Logger.log(LogLevel.DEBUG, "Provisioning step '{0}' {1} in {2} ms".format(
+                step_info['name'],
+                "completed" if step_info['exitCode'] == 0 else "failed (exit code {0})".format(step_info['exitCode']),
+                step_info['duration']
+            ), run=run)
+
+        run.bootstrap_steps.extend(steps)
+
+        if result['failed']:
+            log_tail = execute_remote_command(
+                compute_config,
+                run,
+                "tail -n {0} {1}/{2}".format(Bootstrap.LOG_TAIL_LINES, Bootstrap.BUNDLE_DIR, Bootstrap.LOG_FILE),
+                quiet=True
+            )
+            Logger.log(LogLevel.ERROR, "End of provisioning log:\n{0}".format(log_tail), run=run)
+            raise Exception("Provisioning step '{0}' failed".format(result['failed']))
+
+        return steps
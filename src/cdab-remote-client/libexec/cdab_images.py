@@ -0,0 +1,141 @@
+from cdab_shared import *
+import os
+import shlex
+import threading
+
+
+
+class ImageDistributor:
+    """Distribution of the Docker images required by the test runs of an execution, so that each
+    image is only downloaded once from its registry instead of once per virtual machine.
+
+    The first test run that needs a set of images acts as seed: it pulls the images on its
+    virtual machine and streams them (docker save, gzip-compressed) through its SSH connection
+    into a local cache file. All other test runs wait for the cache file and stream it to their
+    virtual machines (docker load), in parallel, through their own SSH connections.
+    If the seed fails to provide the cache file, the other test runs pull the images themselves.
+    """
+
+    def __init__(self, cache_dir):
+        """Creates the distributor.
+
+        Parameters
+        ----------
+        cache_dir : str
+            The local directory for the cached image archives.
+        """
+        self.cache_dir = cache_dir
+        self.lock = threading.Lock()
+        self.archives = {}
+
+
+
+    def distribute(self, compute_config, run, images):
+        """Makes the given images available on the virtual machine of a test run.
+
+        Parameters
+        ----------
+        compute_config : dict
+            A dict object containing information taken from the compute node of a
+            service provider configuration in the configuration YAML file.
+        run : TestRun
+            The test run object encapsulating all information for the individual test run.
+        images : list of str
+            The references of the required images.
+
+        Returns
+        -------
+        str
+            How the images have been obtained ("updated", "pulled", "loaded" or "pulled (fallback)").
+        """
+
+        # Images may already be present (e.g. on virtual machines leased from the warm pool); as they
+        # are referenced by mutable tags, they are pulled again (only a manifest request if unchanged)
+        missing = execute_remote_command(
+            compute_config,
+            run,
+            ImageDistributor.docker_command(
+                "for i in {0}; do docker image inspect $i > /dev/null 2>&1 || echo $i; done".format(" ".join(images))
+            ),
+            quiet=True
+        ).split()
+        if not missing:
+            self.pull(compute_config, run, images)
+            return "updated"
+
+        key = tuple(sorted(images))
+        with self.lock:
+            archive = self.archives.get(key)
+            seed = archive is None
+            if seed:
+                archive = {
+                    'file': os.path.join(self.cache_dir, "images-{0}.tar.gz".format(len(self.archives) + 1)),
+                    'ready': threading.Event(),
+                    'available': False,
+                }
+                self.archives[key] = archive
+
+        if seed:
+            try:
+                self.pull(compute_config, run, images)
+                Logger.log(LogLevel.INFO, "Saving Docker images for distribution to other virtual machines ...", run=run)
+                try:
+                    execute_remote_stream(
+                        compute_config,
+                        run,
+                        ImageDistributor.pipeline_command("{0} | gzip -1".format(ImageDistributor.docker_command("docker save {0}".format(" ".join(images))))),
+                        output_file=archive['file']
+                    )
+                    archive['available'] = True
+                    Logger.log(LogLevel.INFO, "Docker images saved ({0:.1f} MB)".format(os.path.getsize(archive['file']) / 1048576), run=run)
+                except RunCancelledError:
+                    raise
+                except Exception as e:
+                    Logger.log(LogLevel.WARN, "Docker images could not be saved: {0}".format(str(e)), run=run)
+            finally:
+                archive['ready'].set()
+            return "pulled"
+
+        Logger.log(LogLevel.INFO, "Waiting for Docker images from seed virtual machine ...", run=run)
+        while not archive['ready'].wait(CANCEL_CHECK_INTERVAL):
+            if run.is_cancelled():
+                raise RunCancelledError("Test run cancelled: {0}".format(run.cancel_reason))
+
+        if archive['available']:
+            try:
+                execute_remote_stream(
+                    compute_config,
+                    run,
+                    ImageDistributor.pipeline_command("gunzip | {0} > /dev/null".format(ImageDistributor.docker_command("docker load"))),
+                    input_file=archive['file']
+                )
+                return "loaded"
+            except RunCancelledError:
+                raise
+            except Exception as e:
+                Logger.log(LogLevel.WARN, "Docker images could not be loaded: {0}".format(str(e)), run=run)
+
+        self.pull(compute_config, run, images)
+        return "pulled (fallback)"
+
+
+
+    def pull(self, compute_config, run, images):
+        Logger.log(LogLevel.INFO, "Pulling Docker images {0} ...".format(", ".join(images)), run=run)
+        execute_remote_command(
+            compute_config,
+            run,
+            ImageDistributor.docker_command("for i in {0}; do docker pull -q $i || exit 1; done".format(" ".join(images)))
+        )
+
+
+
+    def docker_command(command):
+        # The membership in the docker group may not yet be effective in the SSH session
+        return "sg docker -c {0}".format(shlex.quote(command))
+
+
+
+    def pipeline_command(command):
+        # A pipeline fails if any of its commands fails (independently of the remote user's login shell)
+        return "bash -o pipefail -c {0}".format(shlex.quote(command))
@@ -0,0 +1,207 @@
+from cdab_shared import *
+import datetime
+import json
+import os
+import threading
+
+
+
+class RunJournal:
+    """State journal of an execution, from which an interrupted execution can be resumed
+    (e.g. after the tool has been killed while the test scenario scripts are still running
+    on the virtual machines).
+
+    The journal is a JSON file containing the command-line arguments of the execution and,
+    for each test run, its phase and the information needed to reattach to its virtual machine
+    (identifiers, IP address, volumes, working directory) and to calculate its metrics (timestamps).
+    It is rewritten atomically at every phase transition of a test run; as it contains
+    the command-line arguments (possibly with credentials), it is only readable by its owner.
+    """
+
+    # Phases of a test run
+    PHASE_QUEUED = "queued"
+    PHASE_CREATING = "creating"
+    PHASE_PROVISIONING = "provisioning"
+    PHASE_RUNNING = "running"
+    PHASE_DOWNLOADING = "downloading"
+    PHASE_DELETING = "deleting"
+    PHASE_FINISHED = "finished"
+
+    # Phases from which a test run can be resumed (the test scenario script has been started)
+    RESUMABLE_PHASES = [ PHASE_RUNNING, PHASE_DOWNLOADING ]
+
+    RUN_ATTRIBUTES = [
+        'phase',
+        'vm_name',
+        'vm_id',
+        'public_ip',
+        'volume_id',
+        'volume_attached',
+        'volume_device',
+        'tmp_volume_id',
+        'tmp_volume_attached',
+        'tmp_volume_device',
+        'leased',
+        'working_dir',
+        'script_name',
+        'images',
+        'remote_exit_code',
+        'queue_wait_time',
+        'operation_times',
+    ]
+
+    TIME_ATTRIBUTES = [
+        'queued_time',
+        'create_start_time',
+        'port_open_time',
+        'ssh_auth_time',
+        'ssh_ready_time',
+        'install_start_time',
+        'test_start_time',
+        'max_end_time',
+        'test_end_time',
+        'files_downloaded_time',
+        'delete_end_time',
+    ]
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+    def __init__(self, file_name, arguments=None, random_sequence=None, start_time=None):
+        """Creates the journal object.
+
+        Parameters
+        ----------
+        file_name : str
+            The path to the journal file.
+        arguments : list of str
+            The command-line arguments of the execution.
+        random_sequence : str
+            The random sequence used in the names of the test runs' resources.
+        start_time : datetime.datetime
+            The start time of the execution.
+        """
+        self.file_name = file_name
+        self.arguments = arguments
+        self.random_sequence = random_sequence
+        self.start_time = start_time
+        self.runs = {}
+        self.lock = threading.Lock()
+
+
+
+    def load(file_name):
+        """Reads a journal file.
+
+        Parameters
+        ----------
+        file_name : str
+            The path to the journal file.
+
+        Returns
+        -------
+        RunJournal
+            The journal object with the content of the file.
+        """
+        with open(file_name, 'r') as f:
+            content = json.loads(f.read())
+
+        journal = RunJournal(
+            file_name,
+            content['arguments'],
+            content['randomSequence'],
+            RunJournal.parse_time(content['startTime'])
+        )
+        journal.runs = { r['index']: r for r in content['runs'] }
+        return journal
+
+
+
+    def update(self, run):
+        """Records the current state of a test run and rewrites the journal file.
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        """
+        state = { 'index': run.index }
+        for name in RunJournal.RUN_ATTRIBUTES:
+            state[name] = getattr(run, name)
+        for name in RunJournal.TIME_ATTRIBUTES:
+            state[name] = RunJournal.format_time(getattr(run, name))
+        state['bootstrap_steps'] = [
+            dict(s, startTime=RunJournal.format_time(s['startTime']), endTime=RunJournal.format_time(s['endTime'])) for s in run.bootstrap_steps
+        ]
+
+        with self.lock:
+            self.runs[run.index] = state
+            self.save()
+
+
+
+    def restore(self, run):
+        """Sets the attributes of a test run to the state recorded in the journal.
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+
+        Returns
+        -------
+        bool
+            Whether the journal contains a state for the test run.
+        """
+        state = self.runs.get(run.index)
+        if state is None:
+            return False
+
+        for name in RunJournal.RUN_ATTRIBUTES:
+            setattr(run, name, state.get(name, getattr(run, name)))
+        for name in RunJournal.TIME_ATTRIBUTES:
+            setattr(run, name, RunJournal.parse_time(state.get(name)))
+        run.bootstrap_steps = [
+            dict(s, startTime=RunJournal.parse_time(s['startTime']), endTime=RunJournal.parse_time(s['endTime'])) for s in state['bootstrap_steps']
+        ]
+        return True
+
+
+
+    def get_resource_ids(self):
+        """Returns the IDs of the virtual machines and volumes of all test runs in the journal.
+        """
+        with self.lock:
+            return [ r[name] for r in self.runs.values() for name in ['vm_id', 'volume_id', 'tmp_volume_id'] if r[name] ]
+
+
+
+    def save(self):
+        content = {
+            'arguments': self.arguments,
+            'randomSequence': self.random_sequence,
+            'startTime': RunJournal.format_time(self.start_time),
+            'runs': [ self.runs[i] for i in sorted(self.runs) ],
+        }
+
+        temp_file = "{0}.tmp".format(self.file_name)
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+            f.write(json.dumps(content, indent=2))
+        os.replace(temp_file, self.file_name)
+
+
+
+    def remove(self):
+        with self.lock:
+            if os.path.exists(self.file_name):
+                os.remove(self.file_name)
+
+
+
+    def format_time(value):
+        return None if value is None else value.strftime(RunJournal.TIME_FORMAT)
+
+
+
+    def parse_time(value):
+        return None if value is None else datetime.datetime.strptime(value, RunJournal.TIME_FORMAT)
@@ -0,0 +1,218 @@
+from cdab_shared import *
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import socket
+
+
+
+class WarmPool:
+    """Registry of provisioned virtual machines that are kept alive after their test run
+    so that they can be leased by later executions (e.g. the next test scenario of a pipeline)
+    instead of creating and provisioning new virtual machines.
+
+    The registry is a JSON file shared by all executions on the same host; all accesses
+    are serialised with an exclusive lock (fcntl) on a lock file next to it.
+    Each entry describes a virtual machine (with the attributes needed to use and delete it),
+    the properties a later test run must match to lease it (service provider, flavour,
+    image, volume usage and remote user), the time it was released to the pool and, while
+    it is in use, its lease (host and process ID of the leasing execution).
+    """
+
+    # Attributes of a test run that are stored in the registry and restored when the virtual machine is leased
+    RUN_ATTRIBUTES = [
+        'vm_name',
+        'vm_id',
+        'public_ip',
+        'volume_id',
+        'volume_attached',
+        'volume_device',
+        'tmp_volume_id',
+        'tmp_volume_attached',
+        'tmp_volume_device',
+    ]
+
+    TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
+
+
+    def __init__(self, registry_file, idle_ttl_hours):
+        """Creates the pool object.
+
+        Parameters
+        ----------
+        registry_file : str
+            The path to the registry file (created if it does not exist).
+        idle_ttl_hours : float
+            The maximum number of hours a virtual machine is kept in the pool without being leased.
+        """
+        self.registry_file = os.path.expanduser(registry_file)
+        self.idle_ttl_hours = idle_ttl_hours
+        self.owner = "{0}:{1}".format(socket.gethostname(), os.getpid())
+
+
+
+    @contextlib.contextmanager
+    def open_registry(self):
+        """Locks the registry and yields its entries; changes to the entries are saved
+        when the context is left.
+        """
+        registry_dir = os.path.dirname(self.registry_file)
+        if registry_dir:
+            os.makedirs(registry_dir, exist_ok=True)
+
+        with open("{0}.lock".format(self.registry_file), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = []
+                if os.path.exists(self.registry_file):
+                    with open(self.registry_file, 'r') as f:
+                        content = f.read()
+                    if content.strip():
+                        entries = json.loads(content)
+
+                yield entries
+
+                temp_file = "{0}.tmp".format(self.registry_file)
+                with open(temp_file, 'w') as f:
+                    f.write(json.dumps(entries, indent=2))
+                os.replace(temp_file, self.registry_file)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+
+    def lease(self, run, key):
+        """Leases an idle virtual machine matching the given properties and sets the
+        attributes of the test run accordingly.
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        key : dict
+            The properties the virtual machine must match.
+
+        Returns
+        -------
+        bool
+            Whether a virtual machine has been leased.
+        """
+        with self.open_registry() as entries:
+            entry = next((e for e in entries if e['key'] == key and e['lease'] is None and not self.is_expired(e)), None)
+            if entry is None:
+                return False
+            entry['lease'] = {
+                'owner': self.owner,
+                'time': WarmPool.now_str(),
+            }
+
+        for name in WarmPool.RUN_ATTRIBUTES:
+            setattr(run, name, entry['run'][name])
+
+        return True
+
+
+
+    def release(self, run, key):
+        """Returns the virtual machine of a test run to the pool (as a new entry if it has not been leased).
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        key : dict
+            The properties of the virtual machine to be matched by later test runs.
+        """
+        with self.open_registry() as entries:
+            entry = next((e for e in entries if e['run']['vm_id'] == run.vm_id), None)
+            if entry is None:
+                entry = {
+                    'key': key,
+                    'created_time': WarmPool.now_str(),
+                }
+                entries.append(entry)
+            entry['run'] = { name: getattr(run, name) for name in WarmPool.RUN_ATTRIBUTES }
+            entry['released_time'] = WarmPool.now_str()
+            entry['lease'] = None
+
+
+
+    def remove(self, run):
+        """Removes the virtual machine of a test run from the pool (e.g. because it has been deleted).
+        """
+        with self.open_registry() as entries:
+            entries[:] = [ e for e in entries if e['run']['vm_id'] != run.vm_id ]
+
+
+
+    def remove_expired(self, key=None):
+        """Removes the virtual machines that have been idle for longer than the idle TTL
+        or whose lease belongs to an execution on this host that no longer exists.
+
+        Parameters
+        ----------
+        key : dict
+            If set, only entries with properties that partially match (e.g. the service provider) are considered.
+
+        Returns
+        -------
+        list of dict
+            The test run attributes of the removed virtual machines, which have to be deleted.
+        """
+        removed = []
+        with self.open_registry() as entries:
+            for entry in list(entries):
+                if key and [ k for k in key if entry['key'].get(k) != key[k] ]:
+                    continue
+                if self.is_expired(entry) or self.is_stale_lease(entry):
+                    entries.remove(entry)
+                    removed.append(entry['run'])
+        return removed
+
+
+
+    def get_resource_ids(self):
+        """Returns the IDs of all virtual machines in the pool (idle or leased) and of their volumes,
+        which must not be deleted as old resources.
+        """
+        ids = []
+        with self.open_registry() as entries:
+            for entry in entries:
+                ids.extend([ entry['run'][name] for name in ['vm_id', 'volume_id', 'tmp_volume_id'] if entry['run'][name] ])
+        return ids
+
+
+
+    def is_expired(self, entry):
+        if entry['lease'] is not None:
+            return False
+        idle_time = datetime.datetime.utcnow() - WarmPool.parse_time(entry['released_time'])
+        return idle_time.total_seconds() > self.idle_ttl_hours * 3600
+
+
+
+    def is_stale_lease(self, entry):
+        if entry['lease'] is None:
+            return False
+        (host, pid) = entry['lease']['owner'].rsplit(':', 1)
+        if host != socket.gethostname() or int(pid) == os.getpid():
+            return False
+        try:
+            os.kill(int(pid), 0)
+            return False
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+
+
+
+    def now_str():
+        return datetime.datetime.utcnow().strftime(WarmPool.TIME_FORMAT)
+
+
+
+    def parse_time(value):
+        return datetime.datetime.strptime(value, WarmPool.TIME_FORMAT)
@@ -0,0 +1,471 @@
+from cdab_shared import *
+import json
+import math
+import os
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import quoteattr
+
+try:
+    import ijson   # optional, for incremental parsing of large result files
+except ImportError:
+    ijson = None
+
+
+
+class ResultMerger:
+    """Merges the test case results of the remote test runs (the testCaseResults nodes of the
+    TestResult-remote*.json files) into one node per test case.
+
+    The result files are added one after the other; each test case node is folded into the
+    aggregated state of its test case as soon as it has been read, so that memory usage depends
+    on the number of distinct test cases and metrics rather than on the number and size of the files.
+    If the ijson package is installed, the files are also parsed incrementally.
+    """
+
+    # Aggregation of the metric values of the different test runs: the kind of aggregation and
+    # the number of decimals for averages; the value of the first test run is used for other metrics
+    AGGREGATIONS = {
+        'avgResponseTime': ('avg', 0),
+        'errorRate': ('avg', 2),
+        'avgConcurrency': ('sum', None),
+        'avgSize': ('avg', 0),
+        'resultsErrorRate': ('avg', 2),
+        'peakResponseTime': ('max', None),
+        'maxSize': ('max', None),
+        'peakConcurrency': ('sum', None),
+        'maxTotalResults': ('max', None),
+        'totalReadResults': ('sum', None),
+        'totalSize': ('sum', None),
+        'throughput': ('sum', None),
+        'dataCollectionDivision': ('concat', None),
+        'processCount': ('sum', None),
+        'avgProcessDuration': ('avg', 0),
+        'responseTimeHistogram': ('histogram', None),
+    }
+
+    # Test case node attributes with specific merge rules; the values of all other attributes are collected in lists
+    KNOWN_ATTRIBUTES = ['testName', 'className', 'startedAt', 'endedAt', 'duration', 'metrics', 'searchFiltersDefinition']
+
+
+
+    def __init__(self, main_test_name):
+        """Creates a result merger.
+
+        Parameters
+        ----------
+        main_test_name : str
+            The name of the main test case of the test scenario, which is not merged
+            (its metrics are produced by the remote client itself).
+        """
+        self.main_test_name = main_test_name
+        self.test_target_url = None
+        self.test_cases = {}
+
+
+
+    def add_file(self, file_name, totals=None):
+        """Reads a remote result file and merges its test case nodes.
+
+        Parameters
+        ----------
+        file_name : str
+            The location of the TestResult-remote*.json file of a test run.
+        totals : dict
+            Metric names (keys) whose numeric values are summed over the merged test case nodes
+            of the file; the sums are set as values (which remain unchanged for metrics that
+            do not occur), e.g. { 'totalSize': None } (default: None).
+
+        Returns
+        -------
+        dict
+            The node of the main test case in the file (if there is one), from which run-specific
+            values are taken, otherwise None.
+        """
+        main_node = None
+        with open(file_name, 'rb') as file:
+            for node in self.read_nodes(file):
+                if 'testName' in node and 'metrics' in node and node['testName'] == self.main_test_name:
+                    main_node = node
+                else:
+                    self.add_node(node)
+                    if totals:
+                        for m in node.get('metrics', []):
+                            if m.get('name') in totals and isinstance(m.get('value'), (int, float)):
+                                totals[m['name']] = (totals[m['name']] or 0) + m['value']
+
+        return main_node
+
+
+
+    def read_nodes(self, file):
+        """Yields the test case nodes of a result file, recording the test target URL if present.
+        """
+        if ijson is None:
+            result_file = json.load(file)
+            if self.test_target_url is None and result_file.get('testTargetUrl'):
+                self.test_target_url = result_file['testTargetUrl']
+            for node in result_file['testCaseResults']:
+                yield node
+            return
+
+        builder = None
+        for (prefix, event, value) in ijson.parse(file, use_float=True):
+            if builder is None:
+                if prefix == 'testTargetUrl' and value and self.test_target_url is None:
+                    self.test_target_url = value
+                elif prefix == 'testCaseResults.item' and event == 'start_map':
+                    builder = ijson.ObjectBuilder()
+            if builder is not None:
+                builder.event(event, value)
+                if prefix == 'testCaseResults.item' and event == 'end_map':
+                    yield builder.value
+                    builder = None
+
+
+
+    def add_node(self, node):
+        """Folds a test case node of a test run into the aggregated state of its test case.
+        """
+        test_case = node['testName']
+        if test_case not in self.test_cases:
+            self.test_cases[test_case] = {
+                'className': None,
+                'startedAt': None,
+                'endedAt': None,
+                'durationSum': 0,
+                'durationCount': 0,
+                'metrics': {},
+                'searchFiltersDefinition': [],
+                'others': {},
+            }
+        state = self.test_cases[test_case]
+
+        if state['className'] is None and 'className' in node:
+            state['className'] = node['className']
+        if node.get('startedAt') and (state['startedAt'] is None or node['startedAt'] < state['startedAt']):
+            state['startedAt'] = node['startedAt']
+        if node.get('endedAt') and (state['endedAt'] is None or node['endedAt'] > state['endedAt']):
+            state['endedAt'] = node['endedAt']
+        if 'duration' in node:
+            state['durationSum'] += node['duration']
+            state['durationCount'] += 1
+
+        for m in node.get('metrics', []):
+            self.add_metric(state['metrics'], m)
+
+        if node.get('searchFiltersDefinition'):
+            state['searchFiltersDefinition'].extend(node['searchFiltersDefinition'])
+
+        for (key, value) in node.items():
+            if key not in ResultMerger.KNOWN_ATTRIBUTES:
+                state['others'].setdefault(key, []).append(value)
+
+
+
+    def add_metric(self, metrics, metric):
+        """Folds a metric of a test run into the aggregated metric of the same name.
+        """
+        name = metric['name']
+        value = metric.get('value')
+        (kind, decimals) = ResultMerger.AGGREGATIONS.get(name, (None, None))
+
+        if name not in metrics:
+            # The first occurrence is kept as template (other attributes such as 'uom')
+            metrics[name] = {
+                'metric': metric.copy(),
+                'kind': kind,
+                'decimals': decimals,
+                'value': [] if kind == 'concat' else Histogram() if kind == 'histogram' else (0 if kind in ('avg', 'sum') else value),
+                'count': 0,
+                'numeric': True,
+            }
+            if kind in ('avg', 'sum', 'concat', 'histogram'):
+                self.add_metric(metrics, metric)
+            return
+
+        aggregate = metrics[name]
+        if kind == 'avg':
+            if isinstance(value, (int, float)) and aggregate['numeric']:
+                aggregate['value'] += value
+            else:
+                aggregate['numeric'] = False
+            aggregate['count'] += 1
+        elif kind == 'sum':
+            aggregate['value'] += value
+        elif kind == 'max':
+            aggregate['value'] = max(aggregate['value'], value)
+        elif kind == 'concat':
+            aggregate['value'].extend(value)
+        elif kind == 'histogram':
+            aggregate['value'].merge(Histogram.from_list(value))
+
+
+
+    def get_test_case_nodes(self):
+        """Returns the merged test case nodes (sorted by test case name).
+        """
+        test_case_nodes = []
+
+        for test_case in sorted(self.test_cases):
+            state = self.test_cases[test_case]
+            merged_node = {
+                'testName': test_case if test_case.startswith('TC') else "TC{0}".format(test_case),
+                'className': state['className'],
+                'startedAt': state['startedAt'],
+                'endedAt': state['endedAt'],
+                'duration': int(round(state['durationSum'] / state['durationCount'])) if state['durationCount'] else None,
+                'metrics': [],
+            }
+
+            for aggregate in state['metrics'].values():
+                merged_metric = aggregate['metric']
+                if aggregate['kind'] == 'avg':
+                    # Same result as TestClient.get_average
+                    if aggregate['count'] == 0 or not aggregate['numeric']:
+                        merged_metric['value'] = "N/A"
+                    elif aggregate['decimals'] == 0:
+                        merged_metric['value'] = int(round(aggregate['value'] / aggregate['count']))
+                    else:
+                        merged_metric['value'] = round(aggregate['value'] / aggregate['count'], aggregate['decimals'])
+                elif aggregate['kind'] == 'histogram':
+                    merged_metric['value'] = aggregate['value'].to_list()
+                elif aggregate['kind'] is not None:
+                    merged_metric['value'] = aggregate['value']
+                merged_node['metrics'].append(merged_metric)
+
+                # Percentiles derived from histograms (e.g. p95ResponseTime from responseTimeHistogram)
+                if aggregate['kind'] == 'histogram':
+                    merged_node['metrics'].extend(ResultMerger.get_percentile_metrics(
+                        merged_metric['name'][:-len("Histogram")], aggregate['value'].get_percentile, merged_metric.get('uom')
+                    ))
+
+            if state['searchFiltersDefinition']:
+                merged_node['searchFiltersDefinition'] = state['searchFiltersDefinition']
+
+            for (key, values) in state['others'].items():
+                merged_node[key] = values
+
+            test_case_nodes.append(merged_node)
+
+        return test_case_nodes
+
+
+
+    def get_percentile_metrics(name, get_percentile, uom):
+        """Returns the metrics p50<Name>, p90<Name> etc. for the percentiles in Histogram.PERCENTILES.
+
+        Parameters
+        ----------
+        name : str
+            The name of the measured quantity (e.g. "responseTime").
+        get_percentile : function
+            A function returning the value of a percentile (or None if there are no values).
+        uom : str
+            The unit of measurement of the values.
+        """
+        return [
+            {
+                'name': "p{0}{1}{2}".format(p, name[0].upper(), name[1:]),
+                'value': get_percentile(p),
+                'uom': uom
+            } for p in Histogram.PERCENTILES
+        ]
+
+
+
+    def get_histogram(self, name):
+        """Returns the histogram metric of the given name merged over all test cases
+        (None if no test case has such a metric).
+        """
+        histograms = [ s['metrics'][name]['value'] for s in self.test_cases.values() if name in s['metrics'] ]
+        if not histograms:
+            return None
+
+        histogram = Histogram()
+        for h in histograms:
+            histogram.merge(h)
+        return histogram
+
+
+
+class Histogram:
+    """Mergeable histogram of non-negative values with logarithmic buckets, from which percentiles
+    can be derived with a bounded relative error, regardless of how many histograms (e.g. of different
+    test runs or test cases) have been merged.
+
+    Bucket i contains the values v with gamma^(i-1) < v <= gamma^i, where gamma = (1 + a) / (1 - a)
+    for the relative accuracy a; values below 1 are in bucket -1 (represented by 0). The encoded form
+    (as produced by the cdab-client, metric responseTimeHistogram) is a flat list of pairs of bucket
+    index and count.
+    """
+
+    # Must be the same as in the cdab-client (MeasurementsAnalyzer.HistogramRelativeAccuracy)
+    RELATIVE_ACCURACY = 0.01
+
+    GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+    # Percentiles reported for distributions
+    PERCENTILES = [50, 90, 95, 99]
+
+
+
+    def __init__(self, values=None):
+        self.counts = {}
+        for v in (values if values else []):
+            self.add(v)
+
+
+
+    def from_list(encoded):
+        """Creates a histogram from its encoded form (pairs of bucket index and count).
+        """
+        histogram = Histogram()
+        for i in range(0, len(encoded) - 1, 2):
+            index = int(encoded[i])
+            histogram.counts[index] = histogram.counts.get(index, 0) + int(encoded[i + 1])
+        return histogram
+
+
+
+    def to_list(self):
+        return [ n for index in sorted(self.counts) for n in (index, self.counts[index]) ]
+
+
+
+    def add(self, value, count=1):
+        index = -1 if value < 1 else math.ceil(math.log(value) / math.log(Histogram.GAMMA))
+        self.counts[index] = self.counts.get(index, 0) + count
+
+
+
+    def merge(self, histogram):
+        for (index, count) in histogram.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+
+
+    def get_count(self):
+        return sum(self.counts.values())
+
+
+
+    def get_percentile(self, percentile):
+        """Returns the given percentile (nearest-rank method, like TestClient.get_percentile)
+        as the representative value of its bucket, or None if the histogram is empty.
+        """
+        count = self.get_count()
+        if count == 0:
+            return None
+
+        rank = max(1, math.ceil(percentile / 100 * count))
+        cumulated = 0
+        for index in sorted(self.counts):
+            cumulated += self.counts[index]
+            if cumulated >= rank:
+                return 0 if index < 0 else int(round(2 * Histogram.GAMMA ** index / (Histogram.GAMMA + 1)))
+
+
+
+class JunitMerger:
+    """Merges the junit.xml files of the remote test runs into one junit.xml file with a single
+    test suite containing the test cases of all test runs.
+
+    The files are read twice with an incremental parser, first to validate them and count the errors
+    (needed for the test suite element at the beginning of the output) and then to copy the test
+    cases one by one into the formatted output, so that the memory usage does not depend on the
+    size of the files.
+    """
+
+    INDENT = "  "
+
+
+
+    def __init__(self):
+        self.files = []
+        self.errors = 0
+
+
+
+    def iterate(file_name):
+        """Yields the testsuite elements of a junit file (below or at the root) when they start
+        (i.e. with their attributes only) and their testcase elements when they are complete.
+        Processed child elements of test suites are removed from the tree.
+        """
+        stack = []
+        for (event, elem) in ET.iterparse(file_name, events=('start', 'end')):
+            if event == 'start':
+                stack.append(elem)
+                if elem.tag == 'testsuite' and len(stack) <= 2:
+                    yield elem
+                continue
+            stack.pop()
+            if stack and stack[-1].tag == 'testsuite' and len(stack) <= 2:
+                if elem.tag == 'testcase':
+                    yield elem
+                stack[-1].remove(elem)
+
+
+
+    def add_file(self, file_name):
+        """Validates a remote junit file and adds its error count (of the first test suite)
+        to the total; the test cases are copied when the output is written.
+
+        Raises
+        ------
+        OSError
+            If the file cannot be read.
+        xml.etree.ElementTree.ParseError
+            If the file is not well-formed; it is not added in this case.
+        """
+        errors = None
+        for elem in JunitMerger.iterate(file_name):
+            if elem.tag == 'testsuite' and errors is None:
+                errors = int(elem.attrib['errors']) if elem.attrib.get('errors') else 0
+
+        self.files.append(file_name)
+        self.errors += errors if errors else 0
+
+
+
+    def write(self, output_file, name, id, errors, testcase_elems=None):
+        """Writes the merged junit file (replacing an existing file atomically).
+
+        Parameters
+        ----------
+        output_file : str
+            The location of the merged junit file.
+        name : str
+            The name of the test suite.
+        id : str
+            The ID of the test suite.
+        errors : int
+            The number of errors in addition to those of the added files.
+        testcase_elems : list of xml.etree.ElementTree.Element
+            Additional test cases appended after those of the added files (default: None).
+        """
+        temp_file = "{0}.tmp".format(output_file)
+        with open(temp_file, 'w', encoding='utf-8') as file:
+            file.write("<?xml version=\"1.0\" encoding=\"utf-8\"?>\n")
+            file.write("<testsuites xmlns:xsd=\"http://www.w3.org/2001/XMLSchema\" xmlns:xsi=\"http://www.w3.org/2001/XMLSchema-instance\">\n")
+            file.write("{0}<testsuite name={1} id={2} errors={3}>\n".format(
+                JunitMerger.INDENT, quoteattr(str(name)), quoteattr(str(id)), quoteattr(str(self.errors + errors))
+            ))
+            for file_name in self.files:
+                try:
+                    for elem in JunitMerger.iterate(file_name):
+                        if elem.tag == 'testcase':
+                            JunitMerger.write_element(file, elem)
+                except (OSError, ET.ParseError) as e:
+                    # Only possible if the file was changed after its validation
+                    Logger.log(LogLevel.WARN, "Test cases of junit file {0} incomplete: {1}".format(file_name, str(e)))
+            for elem in (testcase_elems if testcase_elems else []):
+                JunitMerger.write_element(file, elem)
+            file.write("{0}</testsuite>\n</testsuites>\n".format(JunitMerger.INDENT))
+        os.replace(temp_file, output_file)
+
+
+
+    def write_element(file, elem):
+        elem.tail = None
+        ET.indent(elem, space=JunitMerger.INDENT, level=2)
+        file.write("{0}{1}\n".format(JunitMerger.INDENT * 2, ET.tostring(elem, encoding='unicode')))
@@ -1,10 +1,20 @@
+import collections
+import concurrent.futures
 import datetime
 from enum import Enum
 import json
+import os
+import random
 import re
+import shutil
+import socket
 import subprocess
 import sys
+import tarfile
+import tempfile
+import threading
 import time
+from cdab_trace import Tracer
 
 
 ERR_CONFIG = 10
@@ -12,6 +22,27 @@ ERR_CREATE = 11
 ERR_REMOTE = 12
 ERR_DELETE = 13
 
+# Interval (in seconds) at which running commands and waits check whether their test run has been cancelled
+CANCEL_CHECK_INTERVAL = 0.5
+
+# Maximum number of concurrent deletion requests for old resources
+CLEANUP_PARALLELISM = 8
+
+# Name prefix of virtual machines (and volumes) that are never deleted as old resources (-k option)
+KEPT_NAME_PREFIX = "k-"
+
+# Name prefix of virtual machines (and volumes) created while the warm pool is enabled, which may be
+# leased by executions on other hosts (with a registry of their own) and are therefore deleted as old
+# resources only after a longer retention time
+WARM_POOL_NAME_PREFIX = "wp-"
+
+# Port and timeout (in seconds) of the probe for the SSH server of a new virtual machine
+SSH_PORT = 22
+SSH_PROBE_TIMEOUT = 2
+
+# Timeout (in seconds) of an authenticated SSH check of a new virtual machine
+SSH_CHECK_TIMEOUT = 30
+
 
 def exit_client(exit_code, message):
     print("ERROR: {0}".format(message), file=sys.stderr)
@@ -19,10 +50,236 @@ def exit_client(exit_code, message):
 
 
 
-def await_vm_availability(compute_config, connect_retries, connect_interval, run):
+class RunCancelledError(Exception):
+    """Raised inside a test run when the run has been cancelled (e.g. because it exceeded its
+    maximum duration or because the execution was interrupted).
+    """
+    pass
+
+
+
+def interruptible_sleep(run, seconds):
+    """Waits for the given time, but returns early (raising RunCancelledError) if the test run
+    is cancelled in the meantime.
+
+    Parameters
+    ----------
+    run : TestRun
+        The test run object encapsulating all information for an individual test run
+        (if None, the waiting cannot be interrupted).
+    seconds : float
+        The waiting time in seconds.
+    """
+    if run is None or not run.cancellable:
+        time.sleep(seconds)
+    elif run.cancel_event.wait(seconds):
+        raise RunCancelledError("Test run cancelled: {0}".format(run.cancel_reason))
+
+
+
+# Names of the timed cloud operations (in the order in which they are reported)
+CLOUD_OPERATIONS = [
+    'createRequest',     # creation request of the virtual machine accepted
+    'instanceRunning',   # virtual machine running (after the creation request)
+    'ipAssigned',        # (floating) IP address assigned explicitly
+    'volumeCreated',     # volume created and available
+    'volumeAttached',    # volume attached to the virtual machine
+    'volumeDeleted',     # volume detached and deleted
+    'deleteRequest',     # deletion request of the virtual machine accepted
+    'deleteCompleted',   # virtual machine gone (after the deletion request)
+]
+
+
+
+def record_operation(run, operation, start_time):
+    """Records the duration of a cloud operation of a test run, from the given start time until now.
+
+    Parameters
+    ----------
+    run : TestRun
+        The test run object encapsulating all information for an individual test run
+        (if None, nothing is recorded).
+    operation : str
+        The operation name (one of CLOUD_OPERATIONS).
+    start_time : datetime.datetime
+        The start time of the operation.
+    """
+    if run is None:
+        return
+    end_time = datetime.datetime.utcnow()
+    run.operation_times.append({
+        'operation': operation,
+        'duration': round((end_time - start_time).total_seconds() * 1000),
+    })
+    Tracer.add_span(operation, 'cloud', start_time, end_time, run=run)
+
+
+
+class WaitTimeoutError(Exception):
+    """Raised by wait_for when the awaited condition is not met before the deadline.
+    """
+    pass
+
+
+
+def get_backoff_interval(attempt, initial_interval, max_interval, factor=2):
+    """Returns the waiting time before the next attempt of a polling or retry loop
+    (exponential backoff with jitter, so that parallel test runs do not poll in lockstep).
+
+    Parameters
+    ----------
+    attempt : int
+        The number of attempts made so far (starting at 0).
+    initial_interval : float
+        The waiting time after the first attempt (in seconds, before jitter).
+    max_interval : float
+        The maximum waiting time (in seconds, before jitter).
+    factor : float
+        The factor by which the waiting time grows with each attempt.
+    """
+    interval = min(max_interval, initial_interval * factor ** attempt)
+    return random.uniform(interval / 2, interval)
+
+
+
+def wait_for(run, condition, description, timeout, initial_interval=1, max_interval=15):
+    """Polls a condition with exponential backoff until it is met or the deadline is reached.
+
+    The duration and number of polls of each wait are recorded in the waits attribute
+    of the test run (shown in the timing summary).
+
+    Parameters
+    ----------
+    run : TestRun
+        The test run object encapsulating all information for an individual test run
+        (if None, the waiting cannot be interrupted and is not recorded).
+    condition : function
+        A function without arguments returning None or False while the condition is not met
+        and any other value once it is met (it may raise an exception to abort the waiting,
+        e.g. for an error state).
+    description : str
+        A short description of what is awaited (e.g. "volume available").
+    timeout : float
+        The maximum waiting time in seconds.
+    initial_interval : float
+        The interval between the first polls in seconds.
+    max_interval : float
+        The maximum interval between polls in seconds.
+
+    Returns
+    -------
+    The value returned by the condition function.
+    """
+    start_time = datetime.datetime.utcnow()
+    deadline = time.time() + timeout
+    polls = 0
+    success = False
+    try:
+        while True:
+            result = condition()
+            polls += 1
+            if result is not None and result is not False:
+                success = True
+                return result
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise WaitTimeoutError("Timeout after {0:g} seconds waiting for {1}".format(timeout, description))
+            interruptible_sleep(run, min(remaining, get_backoff_interval(polls - 1, initial_interval, max_interval)))
+    finally:
+        end_time = datetime.datetime.utcnow()
+        if run is not None:
+            run.waits.append({
+                'description': description,
+                'duration': round((end_time - start_time).total_seconds() * 1000),
+                'polls': polls,
+                'success': success,
+            })
+        Tracer.add_span("wait: {0}".format(description), 'wait', start_time, end_time, run=run, args={ 'polls': polls, 'success': success })
+
+
+
+def get_retention_hours(name, vm_name, max_retention_hours, pool_retention_hours):
+    """Returns the age (in hours) from which a virtual machine or volume is deleted as old resource,
+    based on its name.
+
+    Parameters
+    ----------
+    name : str
+        The name of the virtual machine or volume (None if it has no name).
+    vm_name : str
+        The configured name of the virtual machines (with or without WARM_POOL_NAME_PREFIX);
+        if None, resources with any name are considered.
+    max_retention_hours : float
+        The retention time of virtual machines and volumes.
+    pool_retention_hours : float
+        The minimum retention time of virtual machines and volumes of the warm pool (see WARM_POOL_NAME_PREFIX).
+
+    Returns
+    -------
+    The retention time in hours, None if the resource is not to be deleted (kept on request or not
+    matching the configured name).
+    """
+    if name is None:
+        return max_retention_hours if vm_name is None else None
+    if name.lower().startswith(KEPT_NAME_PREFIX):
+        return None
+
+    base_name = vm_name
+    if vm_name is not None and vm_name.startswith(WARM_POOL_NAME_PREFIX):
+        base_name = vm_name[len(WARM_POOL_NAME_PREFIX):]
+
+    if name.startswith(WARM_POOL_NAME_PREFIX):
+        if base_name is None or name[len(WARM_POOL_NAME_PREFIX):].startswith(base_name):
+            return max(max_retention_hours, pool_retention_hours)
+        return None
+
+    return max_retention_hours if base_name is None or name.startswith(base_name) else None
+
+
+
+def delete_resources(resources, delete_function, resource_type):
+    """Deletes old resources in parallel (at most CLEANUP_PARALLELISM at the same time).
+
+    Parameters
+    ----------
+    resources : list of dict
+        The resources to be deleted (as found by a connector's delete_old_resources method).
+    delete_function : function
+        A function deleting a single resource (and logging its deletion); it receives the resource dict as argument.
+    resource_type : str
+        The resource type (e.g. "virtual machine"), used in messages.
+
+    Returns
+    -------
+    int
+        The number of deleted resources.
+    """
+    if not resources:
+        return 0
+
+    deleted = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(CLEANUP_PARALLELISM, len(resources))) as executor:
+        futures = { executor.submit(delete_function, r): r for r in resources }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+                deleted += 1
+            except Exception as e:
+                Logger.log(LogLevel.WARN, "Error during deletion of {0} '{1}': {2}".format(resource_type, futures[future]['id'], str(e)))
+
+    Logger.log(LogLevel.INFO, "{0} {1}(s) deleted".format(deleted, resource_type))
+    return deleted
+
+
+
+def await_vm_availability(compute_config, connect_retries, connect_interval, run, timeout=600):
     """Polls a freshly created virtual machine until it is accessible via SSH.
 
-    There are 3 overall retry rounds, with a waiting time of 30 seconds between them.
+    The readiness is checked in two stages: first, a TCP connection to the SSH port is attempted
+    at short intervals until the SSH server answers with its banner (no process is started for this);
+    then, authenticated SSH connections are attempted with increasing intervals until one succeeds.
+    The times at which the port opened and the authentication first succeeded are recorded in
+    the test run (port_open_time and ssh_auth_time).
 
     Parameters
     ----------
@@ -30,48 +287,59 @@ def await_vm_availability(compute_config, connect_retries, connect_interval, run
         A dict object containing information taken from the compute node of a
         service provider configuration in the configuration YAML file.
     connect_retries : int
-        The number of retries per overall retry round.
+        The maximum number of authenticated SSH connection attempts once the port is open.
     connect_interval : int
-        The time (in seconds) between individual connect retries.
+        The initial time (in seconds) between authenticated SSH connection attempts.
     run : TestRun
         The test run object encapsulating all information for an individual test run.
+    timeout : int
+        The maximum time (in seconds) for both stages together.
 
     Returns
     -------
-    A boolean value indicating whether the virtual machine is available before all retries
-    have been exhausted.
+    A boolean value indicating whether the virtual machine is available before the timeout
+    or the maximum number of attempts is reached.
     """
     Logger.log(LogLevel.INFO, "Awaiting SSH availability ...", run=run)
 
-    available = False
-    max_retries = 3     # max_retries and retry refer to overall retry rounds (each consisting of <connect_retries> SSH connection attempts)
-    retry = 0
+    deadline = time.time() + timeout
 
-    while retry < max_retries and not available:
-        count = 0       # count refers to single SSH connection attemts (in total there can be <max_retries> * <connect_retries>)
-        retry_until_time = datetime.datetime.utcnow() + datetime.timedelta(seconds=connect_retries*connect_interval)
+    def is_port_open():
+        try:
+            with socket.create_connection((run.public_ip, SSH_PORT), timeout=SSH_PROBE_TIMEOUT) as s:
+                return s.recv(256).startswith(b"SSH-")
+        except OSError:
+            return False
 
-        while not available and count < connect_retries:
-            try:
-                response = execute_remote_command(compute_config, run, "ls", quiet=True, timeout=60)
-                available = True
-            except Exception as e:
-                if datetime.datetime.utcnow() >= retry_until_time:
-                    break
-                else:
-                    time.sleep(connect_interval)
-                    count += 1
-                    continue
+    attempts = 0
 
-        if not available:
-            retry += 1
-            if retry == max_retries:
-                Logger.log(LogLevel.ERROR, "Failed to connect to virtual machine", run=run)
-            else:
-                Logger.log(LogLevel.WARN, "Virtual machine not available, retrying after 30 seconds", run=run)
-                time.sleep(30)
+    def is_authenticated():
+        nonlocal attempts
+        attempts += 1
+        try:
+            execute_remote_command(compute_config, run, "true", quiet=True, timeout=SSH_CHECK_TIMEOUT, multiplex=False)
+            return True
+        except RunCancelledError:
+            raise
+        except Exception as e:
+            if attempts >= connect_retries:
+                raise Exception("No successful SSH connection after {0} attempts: {1}".format(attempts, str(e)))
+            return False
 
-    return available
+    try:
+        wait_for(run, is_port_open, "SSH port open", timeout, initial_interval=0.25, max_interval=2)
+        run.port_open_time = datetime.datetime.utcnow()
+        Logger.log(LogLevel.INFO, "SSH port open", run=run)
+
+        wait_for(run, is_authenticated, "SSH authentication", max(1, deadline - time.time()), initial_interval=connect_interval, max_interval=10)
+        run.ssh_auth_time = datetime.datetime.utcnow()
+    except RunCancelledError:
+        raise
+    except Exception as e:
+        Logger.log(LogLevel.ERROR, "Failed to connect to virtual machine: {0}".format(str(e)), run=run)
+        return False
+
+    return True
 
 
 
@@ -97,7 +365,7 @@ def execute_local_command(run, options, json_output=False, exit_code=None, quiet
         The file where the standard output of the command execution is redirected
         (default: no redirection).
     timeout : int
-        The timeout in seconds passed to subprocess.run().
+        The timeout in seconds after which the command is killed.
 
     Returns
     -------
@@ -111,37 +379,59 @@ def execute_local_command(run, options, json_output=False, exit_code=None, quiet
 
     Logger.log(LogLevel.DEBUG, "Command: {0}".format(get_command_str(options)), run=run)
 
-    cp = subprocess.run([ (o[0] if isinstance(o, tuple) else o) for o in options ], stdout=stdout, stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+    args = [ (o[0] if isinstance(o, tuple) else o) for o in options ]
+
+    # For ssh commands, the trace shows the remote command only (without the connection options)
+    with Tracer.span(os.path.basename(args[0]), 'command', run, command=get_command_str(options[-1:] if args[0] == 'ssh' else options).strip()) as trace:
+        process = subprocess.Popen(args, stdout=stdout, stderr=subprocess.PIPE, universal_newlines=True)
 
-    if cp.returncode != 0:
+        # Wait for the command to finish, checking regularly whether the test run has been cancelled
+        end_time = None if timeout is None else time.time() + timeout
+        while True:
+            try:
+                output, error = process.communicate(timeout=CANCEL_CHECK_INTERVAL)
+                break
+            except subprocess.TimeoutExpired:
+                if run is not None and run.is_cancelled():
+                    process.kill()
+                    process.communicate()
+                    raise RunCancelledError("Test run cancelled: {0}".format(run.cancel_reason))
+                if end_time is not None and time.time() >= end_time:
+                    process.kill()
+                    process.communicate()
+                    raise subprocess.TimeoutExpired(args, timeout)
+
+        trace['exitCode'] = process.returncode
+
+    if process.returncode != 0:
         if not quiet:
             print("ERROR: Error executing command", file=stderr)
             print("Command:       {0}".format(get_command_str(options)), file=stderr)
-            print("Return code:   {0}".format(cp.returncode), file=stderr)
-            print("Error message: {0}".format(cp.stderr), file=stderr)
+            print("Return code:   {0}".format(process.returncode), file=stderr)
+            print("Error message: {0}".format(error), file=stderr)
 
         if exit_code is None:
             raise Exception("Error during command execution: {0}".format(get_command_str(options)))
         else:
             if Logger.verbose:
-                Logger.log(LogLevel.DEBUG, cp.stdout)
-            Logger.log(LogLevel.ERROR, cp.stderr)
+                Logger.log(LogLevel.DEBUG, output)
+            Logger.log(LogLevel.ERROR, error)
             exit_client(exit_code, "Error during command execution")
 
     if json_output:
         try:
-            response = json.loads(cp.stdout)
+            response = json.loads(output)
             return response
         except:
-            Logger.log(LogLevel.ERROR, "Invalid response (not JSON): {0}".format(cp.stdout))
+            Logger.log(LogLevel.ERROR, "Invalid response (not JSON): {0}".format(output))
             raise Exception("Invalid response (not JSON)")
 
-    return cp.stdout
+    return output
 
 
 
 
-def execute_remote_command(compute_config, run, command, display_command = None, json_output = False, exit_code = None, quiet = False, timeout=None):
+def execute_remote_command(compute_config, run, command, display_command = None, json_output = False, exit_code = None, quiet = False, timeout=None, multiplex=True):
     """Executes a shell command on a virtual machine using the ssh command.
 
     Parameters
@@ -161,7 +451,10 @@ def execute_remote_command(compute_config, run, command, display_command = None,
     quiet : bool
         Whether or not detailed error information is hidden from the log (default: False).
     timeout : int
-        The timeout in seconds passed to subprocess.run().
+        The timeout in seconds after which the command is killed.
+    multiplex : bool
+        Whether or not the command is sent through the multiplexed connection of the test run,
+        if there is one (default: True).
 
     Returns
     -------
@@ -175,11 +468,11 @@ def execute_remote_command(compute_config, run, command, display_command = None,
     if display_command:
         command = (command, display_command)
 
-    options = [
-        'ssh', '-i', compute_config['private_key_file'],
-        "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "IdentitiesOnly=yes",
+    options = ['ssh']
+    options.extend(get_ssh_options(compute_config, run, multiplex))
+    options.extend([
         "{0}@{1}".format(compute_config['remote_user'], run.public_ip), command
-    ]
+    ])
 
     result = execute_local_command(run, options, json_output=json_output, exit_code=exit_code, quiet=quiet, timeout=timeout)
 
@@ -214,10 +507,8 @@ def copy_file(compute_config, run, local_file, remote_file, to_remote = True, ex
 
     """
 
-    options = [
-        "scp", '-i', compute_config['private_key_file'],
-        "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "IdentitiesOnly=yes",
-    ]
+    options = ['scp']
+    options.extend(get_ssh_options(compute_config, run))
 
     remote_url = "{0}@{1}:{2}".format(compute_config['remote_user'], run.public_ip, remote_file)
 
@@ -227,14 +518,241 @@ def copy_file(compute_config, run, local_file, remote_file, to_remote = True, ex
         options.extend([remote_url, local_file])
 
     try:
-        execute_local_command(run, options, exit_code=exit_code, quiet=quiet)
+        with Tracer.span("copy_file", 'transfer', run, file=remote_file, direction="upload" if to_remote else "download") as trace:
+            execute_local_command(run, options, exit_code=exit_code, quiet=quiet)
+            trace['bytes'] = os.path.getsize(local_file) if os.path.isfile(local_file) else 0
+    except RunCancelledError:
+        raise
     except Exception as e:
         if ignore_error:
             if quiet:  # nothing logged in execute_local_command()
                 Logger.log(LogLevel.ERROR, "Error during file transfer: {0}".format(str(e)), run=run)
         else:
             raise
-    
+
+
+
+
+def download_archive(compute_config, run, remote_dir, files, patterns=None, manifest_file=None, artefact_dir=None):
+    """Downloads result files from the virtual machine in a single transfer: the files are packed
+    into a gzip-compressed tar stream on the remote side, which is unpacked incrementally
+    while it is received.
+
+    Parameters
+    ----------
+    compute_config : dict
+        A dict object containing information taken from the compute node of a
+        service provider configuration in the configuration YAML file.
+    run : TestRun
+        The test run object encapsulating all information for the individual test run to which
+        this file transfer belongs.
+    remote_dir : str
+        The remote directory to which the file names and patterns are relative.
+    files : dict
+        The remote files to be downloaded (keys) and the paths of the corresponding local files (values).
+        Missing remote files are ignored.
+    patterns : list of str
+        Shell glob patterns for additional artefacts to be downloaded (default: None).
+    manifest_file : str
+        A remote file containing further glob patterns for additional artefacts, one per line,
+        e.g. written by the test scenario script (default: None; ignored if not present).
+    artefact_dir : str
+        The local directory for the additional artefacts, which keep their relative remote path
+        (default: None, i.e. additional artefacts are skipped).
+
+    Returns
+    -------
+    list of str
+        The local paths of the received additional artefacts.
+    """
+
+    # Only existing files are listed, as tar fails on missing files
+    selection = "for f in {0}; do [ -e \"$f\" ] && echo \"$f\"; done".format(
+        " ".join([ re.sub(r"([^\w\-./])", r"\\\1", f) for f in files ] + (patterns if patterns and artefact_dir else []))
+    )
+    if manifest_file and artefact_dir:
+        selection = "{{ {0}; [ -f {1} ] && while read -r p; do for f in $p; do [ -e \"$f\" ] && echo \"$f\"; done; done < {1}; }}".format(selection, manifest_file)
+    command = "cd {0} && {1} | tar cf - -T - | gzip -1".format(remote_dir, selection)
+
+    options = ['ssh']
+    options.extend(get_ssh_options(compute_config, run))
+    options.extend(["{0}@{1}".format(compute_config['remote_user'], run.public_ip), command])
+
+    Logger.log(LogLevel.DEBUG, "Command: {0}".format(get_command_str(options)), run=run)
+
+    # The error output is written to a temporary file, as it is only read after the stream: a pipe would
+    # block the remote side (and the transfer) as soon as its buffer is full
+    error_file = tempfile.TemporaryFile()
+    start_time = datetime.datetime.utcnow()
+    process = subprocess.Popen(options, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=error_file)
+
+    # The (blocking) reading of the stream is aborted by killing the process if the test run is cancelled
+    kill_on_cancel(process, run)
+
+    artefacts = []
+    size = 0
+    try:
+        with tarfile.open(fileobj=process.stdout, mode='r|gz') as tar:
+            for member in tar:
+                size += member.size
+                if member.name in files:
+                    local_file = files[member.name]
+                else:
+                    name = os.path.normpath(member.name)
+                    if os.path.isabs(name) or name.startswith(".."):
+                        Logger.log(LogLevel.WARN, "Artefact '{0}' skipped (path outside working directory)".format(member.name), run=run)
+                        continue
+                    local_file = os.path.join(artefact_dir, name)
+                if member.isdir():
+                    os.makedirs(local_file, exist_ok=True)
+                    continue
+                if not member.isfile():
+                    continue
+                if os.path.dirname(local_file):
+                    os.makedirs(os.path.dirname(local_file), exist_ok=True)
+                with open(local_file, 'wb') as target:
+                    shutil.copyfileobj(tar.extractfile(member), target)
+                if member.name not in files:
+                    artefacts.append(local_file)
+    except tarfile.TarError as e:
+        if not run.is_cancelled():
+            Logger.log(LogLevel.ERROR, "Error during download of result files: {0}".format(str(e)), run=run)
+    finally:
+        process.stdout.close()
+        process.wait()
+        error_file.seek(0)
+        error = error_file.read().decode('utf-8', errors='replace')
+        error_file.close()
+        Tracer.add_span("download_archive", 'transfer', start_time, datetime.datetime.utcnow(), run=run, args={ 'bytes': size, 'exitCode': process.returncode })
+
+    if run.is_cancelled():
+        raise RunCancelledError("Test run cancelled: {0}".format(run.cancel_reason))
+
+    if process.returncode != 0:
+        Logger.log(LogLevel.ERROR, "Error during download of result files (return code {0}): {1}".format(process.returncode, error), run=run)
+
+    return artefacts
+
+
+
+def execute_remote_stream(compute_config, run, command, input_file=None, output_file=None):
+    """Executes a shell command on a virtual machine using the ssh command with its standard input
+    read from or its standard output written to a local file (e.g. to transfer large amounts of data
+    through the existing SSH connection without an intermediate file on the virtual machine).
+
+    Parameters
+    ----------
+    compute_config : dict
+        A dict object containing information taken from the compute node of a
+        service provider configuration in the configuration YAML file.
+    run : TestRun
+        The test run object encapsulating all information for the individual test run to which
+        this command execution belongs.
+    command : str
+        The shell command to be executed on the remote machine.
+    input_file : str
+        The local file passed as standard input (default: None, i.e. no input).
+    output_file : str
+        The local file to which the standard output is written (default: None, i.e. output discarded).
+    """
+
+    options = ['ssh']
+    options.extend(get_ssh_options(compute_config, run))
+    options.extend(["{0}@{1}".format(compute_config['remote_user'], run.public_ip), command])
+
+    Logger.log(LogLevel.DEBUG, "Command: {0}".format(get_command_str(options)), run=run)
+
+    start_time = datetime.datetime.utcnow()
+    process = None
+    stdin = open(input_file, 'rb') if input_file else subprocess.DEVNULL
+    stdout = open(output_file, 'wb') if output_file else subprocess.DEVNULL
+    try:
+        process = subprocess.Popen(options, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE)
+        kill_on_cancel(process, run)
+        error = process.stderr.read().decode('utf-8', errors='replace')
+        process.wait()
+    finally:
+        if input_file:
+            stdin.close()
+        if output_file:
+            stdout.close()
+        if Tracer.enabled:
+            data_file = input_file if input_file else output_file
+            Tracer.add_span("execute_remote_stream", 'transfer', start_time, datetime.datetime.utcnow(), run=run, args={
+                'command': command,
+                'bytes': os.path.getsize(data_file) if data_file and os.path.isfile(data_file) else 0,
+                'exitCode': process.returncode if process else None,
+            })
+
+    if run.is_cancelled():
+        raise RunCancelledError("Test run cancelled: {0}".format(run.cancel_reason))
+
+    if process.returncode != 0:
+        raise Exception("Command failed (return code {0}): {1}".format(process.returncode, error.strip()))
+
+
+
+def kill_on_cancel(process, run):
+    """Starts a thread that kills a local process (e.g. a long-running ssh command) when the
+    test run is cancelled, so that blocking reads from the process are aborted.
+    """
+    def watch():
+        while process.poll() is None:
+            if run.is_cancelled():
+                process.kill()
+                return
+            time.sleep(CANCEL_CHECK_INTERVAL)
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
+
+
+def get_ssh_options(compute_config, run, multiplex=True):
+    """Returns the command-line options common to all ssh and scp calls to the virtual
+    machine of a test run.
+
+    Parameters
+    ----------
+    compute_config : dict
+        A dict object containing information taken from the compute node of a
+        service provider configuration in the configuration YAML file.
+    run : TestRun
+        The test run object encapsulating all information for the individual test run.
+    multiplex : bool
+        Whether or not the options for the multiplexed connection of the test run are
+        included, if there is one (default: True).
+
+    Returns
+    -------
+    A list of command-line options.
+    """
+
+    options = [
+        '-i', compute_config['private_key_file'],
+        "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "IdentitiesOnly=yes",
+    ]
+
+    if multiplex and run is not None and run.ssh_connection is not None:
+        options.extend(run.ssh_connection.get_options())
+
+    return options
+
+
+
+
+def close_ssh_connection(run):
+    """Closes the multiplexed SSH connection of a test run (if there is one).
+
+    Parameters
+    ----------
+    run : TestRun
+        The test run object encapsulating all information for an individual test run.
+    """
+
+    if run.ssh_connection is not None:
+        run.ssh_connection.close()
+
 
 
 
@@ -258,6 +776,344 @@ def get_command_str(options):
 
 
 
+class SshConnection:
+    """Manages a persistent, multiplexed SSH connection (OpenSSH ControlMaster) to the virtual
+    machine of a test run. All ssh and scp calls of the test run reuse that connection instead of
+    establishing a new one each time.
+
+    The master connection is opened on first use and reopened transparently if it has been lost
+    (e.g. after a network interruption); if it cannot be opened, the calls fall back to individual
+    connections.
+    """
+
+    # Seconds to wait for the control socket of a newly started master connection
+    OPEN_TIMEOUT = 15
+
+    # Seconds after a failed attempt during which no new master connection is attempted
+    RETRY_DELAY = 30
+
+    def __init__(self, compute_config, run, control_path):
+        """Creates the connection manager (the connection itself is opened on first use).
+
+        Parameters
+        ----------
+        compute_config : dict
+            A dict object containing information taken from the compute node of a
+            service provider configuration in the configuration YAML file.
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        control_path : str
+            The path of the control socket (must be short enough for a UNIX socket path).
+        """
+        self.compute_config = compute_config
+        self.run = run
+        self.control_path = control_path
+        self.process = None
+        self.failed_time = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+
+
+    def get_options(self):
+        """Returns the ssh/scp options for using the master connection, opening or reopening
+        the master connection if necessary.
+
+        Returns
+        -------
+        A list of command-line options (empty if no master connection is available).
+        """
+        with self.lock:
+            if self.closed:
+                return []
+            if not self.is_open() and not self.open():
+                return []
+
+        return [
+            "-o", "ControlMaster=no",
+            "-o", "ControlPath={0}".format(self.control_path),
+        ]
+
+
+
+    def is_open(self):
+        return self.process is not None and self.process.poll() is None and os.path.exists(self.control_path)
+
+
+
+    def open(self):
+        """Starts the master connection as a background process and waits until its control socket
+        is available.
+
+        Returns
+        -------
+        A boolean value indicating whether the master connection is available.
+        """
+        if self.failed_time and time.time() - self.failed_time < SshConnection.RETRY_DELAY:
+            return False
+
+        reconnect = self.failed_time is not None or self.process is not None
+        self.terminate()
+
+        Logger.log(LogLevel.DEBUG, "{0} SSH master connection ...".format("Reopening" if reconnect else "Opening"), run=self.run)
+
+        options = ['ssh']
+        options.extend(get_ssh_options(self.compute_config, self.run, False))
+        options.extend([
+            "-o", "ServerAliveInterval=30", "-o", "ServerAliveCountMax=4",
+            "-o", "ControlMaster=yes",
+            "-o", "ControlPath={0}".format(self.control_path),
+            "-N", "{0}@{1}".format(self.compute_config['remote_user'], self.run.public_ip)
+        ])
+
+        self.process = subprocess.Popen(options, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        open_until_time = time.time() + SshConnection.OPEN_TIMEOUT
+        while time.time() < open_until_time and self.process.poll() is None:
+            if os.path.exists(self.control_path):
+                self.failed_time = None
+                return True
+            time.sleep(0.1)
+
+        Logger.log(LogLevel.WARN, "SSH master connection not available, using individual connections", run=self.run)
+        self.terminate()
+        self.failed_time = time.time()
+        return False
+
+
+
+    def close(self):
+        """Closes the master connection; afterwards, no new master connection is opened for the test run.
+        """
+        with self.lock:
+            self.closed = True
+            self.stop()
+
+
+
+    def reset(self):
+        """Closes the master connection, which is reopened on next use. This is necessary
+        for changes of the remote user's group membership to become effective, since all
+        sessions of a master connection share the groups of the initial login.
+        """
+        with self.lock:
+            if not self.closed:
+                self.stop()
+
+
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            subprocess.run(
+                ['ssh', "-o", "ControlPath={0}".format(self.control_path), "-O", "exit", "{0}@{1}".format(self.compute_config['remote_user'], self.run.public_ip)],
+                stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=10
+            )
+        self.terminate()
+        Logger.log(LogLevel.DEBUG, "SSH master connection closed", run=self.run)
+
+
+
+    def terminate(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+        if os.path.exists(self.control_path):
+            try:
+                os.remove(self.control_path)
+            except OSError:
+                pass
+
+
+
+
+class RemoteLogStreamer:
+    """Follows a growing file on the virtual machine (e.g. the standard output of the test scenario
+    script) while the test is running: the content is appended to a local file as it arrives and
+    written line by line to the log of the test run.
+
+    The file is followed with "tail -F" over the (multiplexed) SSH connection of the test run.
+    When the streaming is stopped, the content not yet received is fetched with one further command.
+    """
+
+    def __init__(self, compute_config, run, remote_file, local_file, label):
+        """Creates the streamer (the streaming is started with start()).
+
+        Parameters
+        ----------
+        compute_config : dict
+            A dict object containing information taken from the compute node of a
+            service provider configuration in the configuration YAML file.
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        remote_file : str
+            The path to the file on the virtual machine.
+        local_file : str
+            The path to the local file.
+        label : str
+            The label prepended to the lines in the log of the test run.
+        """
+        self.compute_config = compute_config
+        self.run = run
+        self.remote_file = remote_file
+        self.local_file = local_file
+        self.label = label
+        self.process = None
+        self.thread = None
+        self.received_size = 0
+        self.complete = False
+
+
+
+    def start(self):
+        options = ['ssh']
+        options.extend(get_ssh_options(self.compute_config, self.run))
+        options.extend([
+            "{0}@{1}".format(self.compute_config['remote_user'], self.run.public_ip),
+            "tail -c +1 -F {0} 2> /dev/null".format(self.remote_file)
+        ])
+        self.local = open(self.local_file, 'wb')
+        self.process = subprocess.Popen(options, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self.thread = threading.Thread(target=self.receive, daemon=True)
+        self.thread.start()
+
+
+
+    def receive(self):
+        for line in iter(self.process.stdout.readline, b''):
+            self.write(line)
+
+
+
+    def write(self, data):
+        self.local.write(data)
+        self.local.flush()
+        self.received_size += len(data)
+        for line in data.decode('utf-8', errors='replace').splitlines():
+            Logger.log(LogLevel.INFO, "{0}: {1}".format(self.label, line), run=self.run)
+
+
+
+    def stop(self):
+        """Stops following the remote file and fetches the remaining content.
+
+        Returns
+        -------
+        bool
+            Whether the local file is a complete copy of the remote file; this is not the case
+            if the remote file was truncated while it was followed or the remaining content
+            could not be fetched.
+        """
+        if self.process is None:
+            return False
+
+        if self.process.poll() is None:
+            self.process.kill()
+        self.thread.join()
+        self.process.stdout.close()
+        self.process.wait()
+
+        if self.run.is_cancelled():
+            self.local.close()
+            return False
+
+        # Fetch the content written after "tail" has been stopped
+        command = "s=$(stat -c %s {0} 2> /dev/null || echo 0); [ $s -ge {1} ] || exit 3; tail -c +{2} {0}".format(self.remote_file, self.received_size, self.received_size + 1)
+        options = ['ssh']
+        options.extend(get_ssh_options(self.compute_config, self.run))
+        options.extend(["{0}@{1}".format(self.compute_config['remote_user'], self.run.public_ip), command])
+        try:
+            result = subprocess.run(options, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=600)
+            if result.returncode == 0:
+                if result.stdout:
+                    self.write(result.stdout)
+                self.complete = True
+        except subprocess.TimeoutExpired:
+            pass
+        finally:
+            self.local.close()
+
+        if not self.complete:
+            Logger.log(LogLevel.WARN, "Streamed copy of {0} incomplete".format(self.remote_file), run=self.run)
+
+        return self.complete
+
+
+
+
+class RunLog:
+    """Log of a test run that is not written to the console directly (parallel test runs without
+    mixed log output). Everything written to it is appended to a log file as it arrives; only the
+    last lines are kept in memory for being written to the console when the test run has finished.
+    """
+
+    def __init__(self, file_name, max_lines, append=False):
+        """Creates the log.
+
+        Parameters
+        ----------
+        file_name : str
+            The path to the log file.
+        max_lines : int
+            The maximum number of lines kept in memory.
+        append : bool
+            Whether an existing log file is continued (e.g. when an execution is resumed) instead of
+            overwritten (default: False).
+        """
+        self.file_name = file_name
+        self.file = open(file_name, 'a' if append else 'w')
+        self.lines = collections.deque(maxlen=max_lines)
+        self.line_count = 0
+        self.partial_line = ""
+        self.lock = threading.Lock()
+
+
+
+    def write(self, text):
+        with self.lock:
+            self.file.write(text)
+            self.file.flush()
+            lines = (self.partial_line + text).split("\n")
+            self.partial_line = lines.pop()
+            self.lines.extend(lines)
+            self.line_count += len(lines)
+        return len(text)
+
+
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+
+
+    def getvalue(self):
+        """Returns the lines kept in memory, preceded by a note if earlier lines have been dropped.
+        """
+        with self.lock:
+            value = ""
+            if self.line_count > len(self.lines):
+                value += "[... {0} earlier lines omitted, see {1} ...]\n".format(self.line_count - len(self.lines), self.file_name)
+            value += "".join(["{0}\n".format(line) for line in self.lines])
+            return value + self.partial_line
+
+
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+
+
 class Logger:
     """Simple class for logging.
     """
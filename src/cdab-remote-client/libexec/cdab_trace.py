@@ -0,0 +1,154 @@
+import contextlib
+import datetime
+import json
+import os
+import threading
+
+
+
+class Tracer:
+    """Records the timeline of an execution as spans (connector calls, remote commands, file transfers,
+    polling waits, bootstrap steps and phases of the test runs) and writes them to a file in the
+    Chrome trace event format, which can be opened with chrome://tracing or https://ui.perfetto.dev.
+
+    Each test run is shown as a separate thread (track) of the timeline; spans not belonging
+    to a test run (e.g. the deletion of old resources) are shown on the track of the main thread.
+    Tracing is disabled unless Tracer.start() has been called, in which case all methods return
+    immediately.
+    """
+
+    # Reference time for the timestamps of the trace events (in microseconds)
+    EPOCH = datetime.datetime(1970, 1, 1)
+
+    enabled = False
+    events = []
+    tracks = {}
+    lock = threading.Lock()
+
+
+
+    def start():
+        """Enables tracing and discards previously recorded spans.
+        """
+        with Tracer.lock:
+            Tracer.events = []
+            Tracer.tracks = { 0: "main" }
+            Tracer.enabled = True
+
+
+
+    def add_span(name, category, start_time, end_time, run=None, args=None):
+        """Records a span with known start and end times.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span (e.g. "ssh" or "connector.create_vm").
+        category : str
+            The category of the span (e.g. "remote", "connector", "wait", "phase").
+        start_time : datetime.datetime
+            The start time of the span (UTC).
+        end_time : datetime.datetime
+            The end time of the span (UTC).
+        run : TestRun
+            The test run to which the span belongs (default: None, i.e. a global span).
+        args : dict
+            Additional information about the span (e.g. exit code or number of bytes transferred).
+        """
+        if not Tracer.enabled or start_time is None or end_time is None:
+            return
+
+        start = Tracer.get_timestamp(start_time)
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': start,
+            'dur': max(0, Tracer.get_timestamp(end_time) - start),
+            'pid': os.getpid(),
+            'tid': Tracer.get_track(run),
+        }
+        if args:
+            event['args'] = args
+
+        with Tracer.lock:
+            Tracer.events.append(event)
+
+
+
+    @contextlib.contextmanager
+    def span(name, category, run=None, **args):
+        """Context manager recording a span for the enclosed code.
+
+        The yielded dict contains the additional information of the span and can be extended
+        within the block; if the block raises an exception, its message is added as 'error'.
+
+        Parameters
+        ----------
+        name : str
+            The name of the span.
+        category : str
+            The category of the span.
+        run : TestRun
+            The test run to which the span belongs (default: None, i.e. a global span).
+        """
+        if not Tracer.enabled:
+            yield args
+            return
+
+        start_time = datetime.datetime.utcnow()
+        try:
+            yield args
+        except BaseException as e:
+            args['error'] = str(e) or type(e).__name__
+            raise
+        finally:
+            Tracer.add_span(name, category, start_time, datetime.datetime.utcnow(), run=run, args=args)
+
+
+
+    def get_track(run):
+        """Returns the track (thread ID in the trace) of a test run, registering its name.
+        """
+        if run is None:
+            return 0
+
+        track = run.index + 1
+        if track not in Tracer.tracks:
+            with Tracer.lock:
+                Tracer.tracks[track] = run.name
+        return track
+
+
+
+    def get_timestamp(time):
+        return int((time - Tracer.EPOCH).total_seconds() * 1000000)
+
+
+
+    def write(file_name, metadata=None):
+        """Writes the recorded spans to a trace file.
+
+        Parameters
+        ----------
+        file_name : str
+            The location of the trace file.
+        metadata : dict
+            Information about the execution stored with the trace (e.g. test scenario and service provider).
+        """
+        if not Tracer.enabled:
+            return
+
+        pid = os.getpid()
+        with Tracer.lock:
+            events = sorted(Tracer.events, key=lambda e: (e['tid'], e['ts']))
+            names = [ { 'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': t, 'args': { 'name': n } } for t, n in sorted(Tracer.tracks.items()) ]
+
+        trace = {
+            'traceEvents': [ { 'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': { 'name': "cdab-remote-client" } } ] + names + events,
+            'displayTimeUnit': 'ms',
+            'otherData': metadata if metadata else {},
+        }
+
+        with open(file_name, 'w') as f:
+            json.dump(trace, f, default=str)
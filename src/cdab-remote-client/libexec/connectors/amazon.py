@@ -11,6 +11,10 @@ import sys
 
 class AmazonConnector:
 
+    # Maximum time (seconds) to wait for an instance to be running
+    INSTANCE_RUNNING_TIMEOUT = 600
+
+
     def __init__(self, client):
         self.client = client
         self.compute_config = self.client.compute_config
@@ -52,7 +56,7 @@ class AmazonConnector:
 
 
 
-    def delete_old_resources(self, max_retention_hours):
+    def delete_old_resources(self, max_retention_hours, keep_ids=None, pool_retention_hours=0):
 
         now = datetime.datetime.now().astimezone(pytz.utc)   # not utc_now(), astimezone(pytz.utc), which is required for difference calculation, 
                                                              # still interprets it as local time
@@ -62,10 +66,17 @@ class AmazonConnector:
         unused_vms = []
         for reservation in response['Reservations']:
             for instance in reservation['Instances']:
+                if keep_ids and instance['InstanceId'] in keep_ids:
+                    continue
+                # Instances are not filtered by name (those created in bulk have none)
+                name = next((t['Value'] for t in instance.get('Tags', []) if t['Key'] == 'Name'), None)
+                retention_hours = get_retention_hours(name, None, max_retention_hours, pool_retention_hours)
+                if retention_hours is None:
+                    continue
                 launch_time = instance['LaunchTime'].astimezone(pytz.utc)
                 time_diff = now - launch_time
-                if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
-                    unused_vms.append({'id': instance['InstanceId'], 'created_time': launch_time})
+                if time_diff.days * 24 + time_diff.seconds // 3600 >= retention_hours:
+                    unused_vms.append({'id': instance['InstanceId'], 'created_time': launch_time, 'retention_hours': retention_hours})
 
         if unused_vms:
             try:
@@ -73,7 +84,7 @@ class AmazonConnector:
                     InstanceIds=[v['id'] for v in unused_vms]
                 )
                 for v in unused_vms:
-                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' deleted (created on {1}, more than {2} hours ago)".format(v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
+                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' deleted (created on {1}, more than {2} hours ago)".format(v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), v['retention_hours']))
 
                 Logger.log(LogLevel.INFO, "{0} virtual machine(s) deleted".format(len(unused_vms)))
             except Exception as e:
@@ -84,27 +95,21 @@ class AmazonConnector:
 
         unused_volumes = []
         for volume in response['Volumes']:
+            if keep_ids and volume['VolumeId'] in keep_ids:
+                continue
             created_time = volume['CreateTime'].astimezone(pytz.utc)
             time_diff = now - created_time
             if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
                 unused_volumes.append({'id': volume['VolumeId'], 'created_time': created_time})
 
-        if unused_volumes:
-            deleted = 0
-            for v in unused_volumes:
-                try:
-                    self.ec2_client.delete_volume(
-                        VolumeId=v['id']
-                    )
-                    Logger.log(LogLevel.INFO, "Volume '{0}' deleted (created on {1}, more than {2} hours ago)".format(v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
+        def delete_volume(v):
+            self.ec2_client.delete_volume(
+                VolumeId=v['id']
+            )
+            Logger.log(LogLevel.INFO, "Volume '{0}' deleted (created on {1}, more than {2} hours ago)".format(v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
 
-                    deleted += 1
+        delete_resources(unused_volumes, delete_volume, "volume")
 
-                except Exception as e:
-                    Logger.log(LogLevel.WARN, "Error during deletion of volume: {0}".format(str(e)))
-            
-            Logger.log(LogLevel.INFO, "{0} volume(s) deleted".format(deleted))
-                
 
 
     def prepare(self):
@@ -128,42 +133,110 @@ class AmazonConnector:
 
 
    
-    def create_vm(self, run):
+    def get_instance_options(self, run, count):
+        """Returns the options for the creation request of virtual machines (EC2 instances).
+        """
+        options = {
+            'ImageId': self.compute_config['image_name'],
+            'SecurityGroupIds': [self.compute_config['security_group']],
+            'BlockDeviceMappings': [
+                {
+                    'DeviceName': "/dev/sda1",
+                    'Ebs': {
+                        'DeleteOnTermination': True,
+                        'VolumeSize': 20,
+                    }
+                }
+            ],
+            'MinCount': count,
+            'MaxCount': count,
+            'InstanceType': run.flavor,
+            'KeyName': self.compute_config['key_name']
+        }
 
-        Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
+        # Only an individual instance can be named after its test run (the name protects
+        # virtual machines of the warm pool from the deletion of old resources)
+        if count == 1:
+            options['TagSpecifications'] = [
+                {
+                    'ResourceType': 'instance',
+                    'Tags': [ {'Key': 'Name', 'Value': run.vm_name} ]
+                }
+            ]
+
+        # Software installation via cloud-init, if configured
+        user_data = self.client.get_user_data(run)
+        if user_data:
+            options['UserData'] = user_data
+
+        return options
+
+
+
+    def create_vms(self, runs):
+        """Requests the virtual machines of several test runs (with the same flavour) with a single
+        call (multiple instance count); the instances are assigned to the test runs in the order
+        returned. The creation is completed for each test run by create_vm.
+
+        Parameters
+        ----------
+        runs : list of TestRun
+            The test run objects (the first provides the user data).
+        """
+        options = self.get_instance_options(runs[0], len(runs))
+
+        create_start_time = datetime.datetime.utcnow()
+        for run in runs:
+            run.create_start_time = create_start_time
+        instances = self.ec2_resource.create_instances(**options)
+        for run in runs:
+            record_operation(run, 'createRequest', create_start_time)
+
+        for (run, instance) in zip(runs, instances):
+            run.vm_id = instance.instance_id
+            run.bulk_created = True
+            Logger.log(LogLevel.INFO, "Virtual machine '{0}' created in bulk".format(run.vm_id), run=run)
+            self.client.update_journal(run)
 
 
-        try:
-            run.create_start_time = datetime.datetime.utcnow()
-            instances = self.ec2_resource.create_instances(
-                ImageId=self.compute_config['image_name'],
-                SecurityGroupIds=[self.compute_config['security_group']],
-                BlockDeviceMappings=[
-                    {
-                        'DeviceName': "/dev/sda1",
-                        'Ebs': {
-                            'DeleteOnTermination': True,
-                            'VolumeSize': 20,
-                        }
-                    }
-                ],
-                MinCount=1,
-                MaxCount=1,
-                InstanceType=run.flavor,
-                KeyName=self.compute_config['key_name']
-            )
 
-            instance = instances[0]
-            run.vm_id = instance.instance_id
-            
-            instance.wait_until_running()
+    def create_vm(self, run):
 
-            response = self.ec2_client.describe_instances(
-                InstanceIds=[instance.instance_id]
-            )
+        if run.bulk_created:
+            Logger.log(LogLevel.INFO, "Waiting for virtual machine created in bulk ...", run=run)
+        else:
+            Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
 
-            instance = next((i for r in response['Reservations'] for i in r['Instances']), None)
-            if instance and 'PublicIpAddress' in instance:
+        try:
+            if not run.bulk_created:
+                options = self.get_instance_options(run, 1)
+                run.create_start_time = datetime.datetime.utcnow()
+                instances = self.ec2_resource.create_instances(**options)
+                record_operation(run, 'createRequest', run.create_start_time)
+
+                instance = instances[0]
+                run.vm_id = instance.instance_id
+                self.client.update_journal(run)
+            
+            # The state and the IP address are obtained with the same call
+            def get_running_instance():
+                try:
+                    response = self.ec2_client.describe_instances(
+                        InstanceIds=[run.vm_id]
+                    )
+                except self.ec2_client.exceptions.ClientError as e:
+                    if 'InvalidInstanceID.NotFound' in str(e):
+                        return None   # new instance not yet visible (eventual consistency)
+                    raise
+                instance = next((i for r in response['Reservations'] for i in r['Instances']), None)
+                if instance and instance['State']['Name'] in ['shutting-down', 'terminated']:
+                    raise Exception("Instance is {0}".format(instance['State']['Name']))
+                return instance if instance and instance['State']['Name'] == 'running' else None
+
+            start_time = datetime.datetime.utcnow()
+            instance = wait_for(run, get_running_instance, "virtual machine running", AmazonConnector.INSTANCE_RUNNING_TIMEOUT, initial_interval=2)
+            record_operation(run, 'instanceRunning', start_time)
+            if 'PublicIpAddress' in instance:
                 run.public_ip = instance['PublicIpAddress']
 
             if run.public_ip:
@@ -171,12 +244,14 @@ class AmazonConnector:
             else:
                 raise Exception("No IP address found")
 
+        except RunCancelledError:
+            raise
         except Exception as e:
             exit_client(ERR_CREATE, "Error during creation of Amazon AWS EC2 VM instance: {0}".format(str(e)))
 
         # Wait for actual availability (SSH):
         connect_start_time = datetime.datetime.utcnow()
-        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run)
+        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run, self.client.ssh_ready_timeout)
 
         if available:
             run.ssh_ready_time = datetime.datetime.utcnow()
@@ -191,19 +266,23 @@ class AmazonConnector:
 
 
     def delete_vm(self, run):
+        close_ssh_connection(run)
+
         if run.vm_id is None:
             return True
 
-        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}{1}' ...".format(self.compute_config['vm_name'], run.suffix), run=run)
+        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}' ...".format(run.vm_name), run=run)
 
         max_retries = 3
         retry = 0
         deleted = False
         while retry < max_retries and not deleted:
             try:
+                start_time = datetime.datetime.utcnow()
                 response = self.ec2_client.terminate_instances(
                     InstanceIds=[run.vm_id]
                 )
+                record_operation(run, 'deleteRequest', start_time)
                 
                 Logger.log(LogLevel.INFO, "Virtual machine deleted", run=run)
                 run.delete_end_time = datetime.datetime.utcnow()
@@ -220,8 +299,9 @@ class AmazonConnector:
                     Logger.log(LogLevel.ERROR, "Delete manually", run=run)
                     print("********************************************************************", file=run.stderr)
                 else:
-                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                    time.sleep(30)
+                    interval = get_backoff_interval(retry - 1, 10, 30)
+                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after {0:.0f} seconds".format(interval), run=run)
+                    time.sleep(interval)
 
 
 
@@ -3,6 +3,7 @@ from azure.identity import DefaultAzureCredential
 from azure.mgmt.compute import ComputeManagementClient
 from azure.mgmt.network import NetworkManagementClient
 from azure.mgmt.resource import ResourceManagementClient
+import base64
 import os
 import datetime
 import pytz
@@ -61,31 +62,42 @@ class AzureConnector:
 
 
 
-    def delete_old_resources(self, max_retention_hours):
+    def delete_old_resources(self, max_retention_hours, keep_ids=None, pool_retention_hours=0):
         now = datetime.datetime.now(datetime.timezone.utc)
 
         unused_vms = []
         vm_list = self.compute_client.virtual_machines.list(self.compute_config['resource_group_name'])
 
         for vm in vm_list:
-            if not vm.name.startswith(self.compute_config['vm_name']) or vm.name.lower().startswith('k-'):
+            retention_hours = get_retention_hours(vm.name, self.compute_config['vm_name'], max_retention_hours, pool_retention_hours)
+            if retention_hours is None:
+                continue
+            if keep_ids and vm.id in keep_ids:
                 continue
             created_time = vm.time_created
             time_diff = now - created_time
-            if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
-                unused_vms.append({'id': vm.id, 'name': vm.name, 'created_time': created_time})
+            if time_diff.days * 24 + time_diff.seconds // 3600 >= retention_hours:
+                unused_vms.append({'id': vm.id, 'name': vm.name, 'created_time': created_time, 'retention_hours': retention_hours})
+
+        # All deletions are started first, then their pollers are awaited together
+        pollers = []
+        for v in unused_vms:
+            try:
+                poller = self.compute_client.virtual_machines.begin_delete(
+                    self.compute_config['resource_group_name'],
+                    v['name']
+                )
+                pollers.append((v, poller))
+            except Exception as e:
+                Logger.log(LogLevel.WARN, "Error during deletion of virtual machine: {0}".format(str(e)))
 
         if unused_vms:
             deleted = 0
-            for v in unused_vms:
+            for (v, poller) in pollers:
                 try:
-                    poller = self.compute_client.virtual_machines.begin_delete(
-                        self.compute_config['resource_group_name'],
-                        v['name']
-                    )
                     vm_result = poller.result()
 
-                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
+                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), v['retention_hours']))
 
                     deleted += 1
 
@@ -110,14 +122,18 @@ class AzureConnector:
 
 
         
-    def create_vm(self, run):
-
-        Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
+    def begin_create(self, run):
+        """Starts the creation of the virtual machine of a test run.
 
+        Returns
+        -------
+        The poller for the creation.
+        """
         if run.index >= len(self.available_ip_configurations):
             Logger.log(LogLevel.ERROR, "No IP address available", run=run)
 
         ip_configuration = self.available_ip_configurations[run.index]
+        run.public_ip = ip_configuration['ip_address']
 
         # If flavour is shorthand, make it fully qualified
         vm_config = {
@@ -162,15 +178,56 @@ class AzureConnector:
             }
         }
 
+        # Software installation via cloud-init, if configured
+        user_data = self.client.get_user_data(run)
+        if user_data:
+            vm_config['os_profile']['custom_data'] = base64.b64encode(user_data.encode('utf-8')).decode('ascii')
+
+        run.create_start_time = datetime.datetime.utcnow()
+        poller = self.compute_client.virtual_machines.begin_create_or_update(
+            self.compute_config['resource_group_name'],
+            run.vm_name,
+            vm_config   
+        )
+        record_operation(run, 'createRequest', run.create_start_time)
+        run.create_requested_time = datetime.datetime.utcnow()
+        return poller
+
+
+
+    def create_vms(self, runs):
+        """Starts the creation of the virtual machines of several test runs at once; Azure has
+        no bulk creation of individual virtual machines, so the requests are sent one after the
+        other without waiting for their completion. The creation is completed (the poller is
+        awaited) for each test run by create_vm.
+
+        Parameters
+        ----------
+        runs : list of TestRun
+            The test run objects.
+        """
+        for run in runs:
+            run.create_poller = self.begin_create(run)
+            run.bulk_created = True
+            Logger.log(LogLevel.INFO, "Creation of virtual machine '{0}' started in bulk".format(run.vm_name), run=run)
+
+
+
+    def create_vm(self, run):
+
+        if run.bulk_created:
+            Logger.log(LogLevel.INFO, "Waiting for virtual machine created in bulk ...", run=run)
+        else:
+            Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
+
         try:
-            run.create_start_time = datetime.datetime.utcnow()
-            poller = self.compute_client.virtual_machines.begin_create_or_update(
-                self.compute_config['resource_group_name'],
-                "{0}{1}".format(self.compute_config['vm_name'], run.suffix),
-                vm_config   
-            )
+            if run.bulk_created:
+                poller = run.create_poller
+            else:
+                poller = self.begin_create(run)
 
             vm_result = poller.result()
+            record_operation(run, 'instanceRunning', run.create_requested_time)
             run.vm_id = vm_result.id
 
             try:
@@ -179,16 +236,16 @@ class AzureConnector:
             except:
                 Logger.log(LogLevel.WARN, "Disk ID not retrieved (disk has to be deleted manually)", run=run)
 
-            Logger.log(LogLevel.INFO, "Virtual machine '{0}{1}' created (ID = {2})".format(self.compute_config['vm_name'], run.suffix, run.vm_id), run=run)
-    
-            run.public_ip = ip_configuration['ip_address']
+            self.client.update_journal(run)
+
+            Logger.log(LogLevel.INFO, "Virtual machine '{0}' created (ID = {1})".format(run.vm_name, run.vm_id), run=run)
 
         except Exception as e:
             exit_client(ERR_CREATE, "Error during creation of Azure VM instance: {0}".format(str(e)))
 
         # Wait for actual availability (SSH):
         connect_start_time = datetime.datetime.utcnow()
-        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run)
+        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run, self.client.ssh_ready_timeout)
 
         if available:
             run.ssh_ready_time = datetime.datetime.utcnow()
@@ -203,27 +260,35 @@ class AzureConnector:
 
 
     def delete_vm(self, run):
+        close_ssh_connection(run)
+
         if run.vm_id is None:
             return True
 
-        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}{1}' ...".format(self.compute_config['vm_name'], run.suffix), run=run)
+        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}' ...".format(run.vm_name), run=run)
 
         max_retries = 3
         retry = 0
         deleted = False
         while retry < max_retries and not deleted:
             try:
+                start_time = datetime.datetime.utcnow()
                 poller = self.compute_client.virtual_machines.begin_delete(
                     self.compute_config['resource_group_name'],
-                    "{0}{1}".format(self.compute_config['vm_name'], run.suffix)
+                    run.vm_name
                 )
+                record_operation(run, 'deleteRequest', start_time)
+                start_time = datetime.datetime.utcnow()
                 vm_result = poller.result()
+                record_operation(run, 'deleteCompleted', start_time)
 
                 Logger.log(LogLevel.INFO, "Virtual machine deleted", run=run)
 
                 Logger.log(LogLevel.INFO, "Deleting attached disk '{0}' ...".format(run.volume_id), run=run)
+                start_time = datetime.datetime.utcnow()
                 poller = self.compute_client.disks.begin_delete(self.compute_config['resource_group_name'], run.volume_id)
                 disk_result = poller.result()
+                record_operation(run, 'volumeDeleted', start_time)
 
                 Logger.log(LogLevel.INFO, "Disk deleted", run=run)
 
@@ -241,8 +306,9 @@ class AzureConnector:
                     Logger.log(LogLevel.ERROR, "Delete manually", run=run)
                     print("********************************************************************", file=run.stderr)
                 else:
-                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                    time.sleep(30)
+                    interval = get_backoff_interval(retry - 1, 10, 30)
+                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after {0:.0f} seconds".format(interval), run=run)
+                    time.sleep(interval)
 
 
 
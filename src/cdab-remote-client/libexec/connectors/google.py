@@ -10,6 +10,14 @@ import sys
 
 class GoogleConnector:
 
+    # Maximum time (seconds) to wait for a zone operation (creation or deletion of a virtual machine)
+    OPERATION_TIMEOUT = 900
+
+    # States of instances from an incomplete bulk insert that are taken over by their test runs
+    # (instances in other states are deleted)
+    ADOPTABLE_STATES = [ 'PROVISIONING', 'STAGING', 'RUNNING' ]
+
+
     def __init__(self, client):
         self.client = client
         self.compute_config = self.client.compute_config
@@ -58,7 +66,7 @@ class GoogleConnector:
 
 
 
-    def delete_old_resources(self, max_retention_hours):
+    def delete_old_resources(self, max_retention_hours, keep_ids=None, pool_retention_hours=0):
         now = datetime.datetime.now().astimezone(pytz.utc)   # not utc_now(), astimezone(pytz.utc), which is required for difference calculation, 
                                                              # still interprets it as local time
 
@@ -70,25 +78,36 @@ class GoogleConnector:
 
         if 'items' in response:
             for item in response['items']:
-                if not item['name'].startswith(self.compute_config['vm_name']) or item['name'].lower().startswith('k-'):
+                retention_hours = get_retention_hours(item['name'], self.compute_config['vm_name'], max_retention_hours, pool_retention_hours)
+                if retention_hours is None:
+                    continue
+                if keep_ids and item['id'] in keep_ids:
                     continue
                 ct = re.sub('\.\d+([\+-]\d\d):?(\d\d)', '\g<1>\g<2>', item['creationTimestamp'])   # Python 3.6 issue, strip milliseconds and ':' in time zone offset
                 created_time = datetime.datetime.strptime(ct, '%Y-%m-%dT%H:%M:%S%z').astimezone(pytz.utc)
                 time_diff = now - created_time
-                if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
-                    unused_vms.append({'id': item['id'], 'name': item['name'], 'created_time': created_time})
+                if time_diff.days * 24 + time_diff.seconds // 3600 >= retention_hours:
+                    unused_vms.append({'id': item['id'], 'name': item['name'], 'created_time': created_time, 'retention_hours': retention_hours})
+
+            # All deletions are requested first, then the operations are awaited together
+            operations = []
+            for v in unused_vms:
+                try:
+                    operation = self.compute.instances().delete(
+                        project=self.compute_config['project_id'],
+                        zone=self.compute_config['region_name'],
+                        instance=v['id']
+                    ).execute()
+                    operations.append((v, operation['name']))
+                except Exception as e:
+                    Logger.log(LogLevel.WARN, "Error during deletion of virtual machine: {0}".format(str(e)))
 
             if unused_vms:
                 deleted = 0
-                for v in unused_vms:
+                for (v, operation) in operations:
                     try:
-                        operation = self.compute.instances().delete(
-                            project=self.compute_config['project_id'],
-                            zone=self.compute_config['region_name'],
-                            instance=v['id']
-                        ).execute()
-                        self.wait_for_operation(operation['name'], self.compute)
-                        Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
+                        self.wait_for_operation(operation, self.compute)
+                        Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), v['retention_hours']))
 
                         deleted += 1
 
@@ -124,12 +143,9 @@ class GoogleConnector:
 
 
         
-    def create_vm(self, run):
-
-        run.compute = googleapiclient.discovery.build('compute', 'v1')
-
-        Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
-
+    def get_instance_config(self, run):
+        """Returns the configuration for the creation request of the virtual machine of a test run.
+        """
         # If flavour is shorthand, make it fully qualified
         if '/' in run.flavor:
             flavor = run.flavor
@@ -137,7 +153,7 @@ class GoogleConnector:
             flavor = "projects/{0}/zones/{1}/machineTypes/{2}".format(self.compute_config['project_id'], self.compute_config['region_name'], run.flavor)
 
         config = {
-            'name': "{0}{1}".format(self.compute_config['vm_name'], run.suffix),
+            'name': run.vm_name,
             'machineType': flavor,
             'disks': [
                 {
@@ -167,27 +183,143 @@ class GoogleConnector:
             }]
         }
 
+        # Software installation via startup script (the equivalent of cloud-init user data), if configured
+        user_data = self.client.get_user_data(run)
+        if user_data:
+            config['metadata'] = {
+                'items': [
+                    {'key': 'startup-script', 'value': user_data}
+                ]
+            }
+
+        return config
+
+
+
+    def create_vms(self, runs):
+        """Requests the virtual machines of several test runs (with the same flavour) with a single
+        bulk insert call, which names each instance after its test run. The creation is completed
+        for each test run by create_vm.
+
+        If the bulk insert was accepted, but did not complete, the instances that exist nevertheless
+        are taken over by their test runs or deleted, so that the individual creation of the remaining
+        virtual machines (with the same names) does not fail.
+
+        Parameters
+        ----------
+        runs : list of TestRun
+            The test run objects (the first provides the user data).
+        """
+        compute = googleapiclient.discovery.build('compute', 'v1')
+
+        properties = self.get_instance_config(runs[0])
+        del properties['name']
+        properties['machineType'] = properties['machineType'].split('/')[-1]   # bulk insert requires the short name
+
+        create_start_time = datetime.datetime.utcnow()
+        for run in runs:
+            run.create_start_time = create_start_time
+        operation = compute.instances().bulkInsert(
+            project=self.compute_config['project_id'],
+            zone=self.compute_config['region_name'],
+            body={
+                'count': len(runs),
+                'minCount': len(runs),
+                'perInstanceProperties': { run.vm_name: {} for run in runs },
+                'instanceProperties': properties,
+            }
+        ).execute()
+        for run in runs:
+            record_operation(run, 'createRequest', create_start_time)
+
+        complete = True
         try:
-            run.create_start_time = datetime.datetime.utcnow()
-            operation = run.compute.instances().insert(
-                project=self.compute_config['project_id'],
-                zone=self.compute_config['region_name'],
-                body=config
-            ).execute()
-    
-            if 'targetId' in operation:
-                run.vm_id = operation['targetId']
-                Logger.log(LogLevel.INFO, "Virtual machine '{0}{1}' created (target ID = {2})".format(self.compute_config['vm_name'], run.suffix, run.vm_id), run=run)
+            start_time = datetime.datetime.utcnow()
+            self.wait_for_operation(operation['name'], compute, runs[0])
+            for run in runs:
+                record_operation(run, 'instanceRunning', start_time)
+        except Exception as e:
+            complete = False
+            Logger.log(LogLevel.WARN, "Bulk creation of virtual machines incomplete: {0}".format(str(e)), run=runs[0])
+
+        # The IDs of all instances are obtained with a single list call (filtered by the names of
+        # the test runs; the result pages are followed nevertheless)
+        items = {}
+        request = compute.instances().list(
+            project=self.compute_config['project_id'],
+            zone=self.compute_config['region_name'],
+            filter=" OR ".join(['(name = "{0}")'.format(run.vm_name) for run in runs]),
+        )
+        while request is not None:
+            response = request.execute()
+            for item in response.get('items', []):
+                items[item['name']] = item
+            request = compute.instances().list_next(previous_request=request, previous_response=response)
+
+        operations = []
+        for run in runs:
+            if run.vm_name not in items:
+                continue
+            item = items[run.vm_name]
+            if complete or item['status'] in GoogleConnector.ADOPTABLE_STATES:
+                run.vm_id = item['id']
+                run.bulk_created = True
+                Logger.log(LogLevel.INFO, "Virtual machine '{0}' created in bulk (target ID = {1})".format(run.vm_name, run.vm_id), run=run)
+                self.client.update_journal(run)
             else:
-                raise Exception("No targetId in response")
+                Logger.log(LogLevel.WARN, "Deleting virtual machine '{0}' from incomplete bulk creation (status: {1}) ...".format(run.vm_name, item['status']), run=run)
+                operation = compute.instances().delete(
+                    project=self.compute_config['project_id'],
+                    zone=self.compute_config['region_name'],
+                    instance=item['id']
+                ).execute()
+                operations.append((run, operation['name']))
 
-            self.wait_for_operation(operation['name'], run.compute)
+        # The names must be free again before the virtual machines are created individually
+        for (run, operation) in operations:
+            self.wait_for_operation(operation, compute, run)
 
-            response = run.compute.instances().get(
-                instance="{0}{1}".format(self.compute_config['vm_name'], run.suffix),
-                project=self.compute_config['project_id'],
-                zone=self.compute_config['region_name'],
-            ).execute()
+
+
+    def create_vm(self, run):
+
+        run.compute = googleapiclient.discovery.build('compute', 'v1')
+
+        try:
+            if run.bulk_created:
+                Logger.log(LogLevel.INFO, "Virtual machine created in bulk", run=run)
+
+                # Virtual machines taken over from an incomplete bulk insert may still be starting
+                response = wait_for(run, lambda: self.get_running_instance(run), "virtual machine {0}".format(run.vm_name), GoogleConnector.OPERATION_TIMEOUT)
+            else:
+                Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
+
+                config = self.get_instance_config(run)
+
+                run.create_start_time = datetime.datetime.utcnow()
+                operation = run.compute.instances().insert(
+                    project=self.compute_config['project_id'],
+                    zone=self.compute_config['region_name'],
+                    body=config
+                ).execute()
+                record_operation(run, 'createRequest', run.create_start_time)
+        
+                if 'targetId' in operation:
+                    run.vm_id = operation['targetId']
+                    self.client.update_journal(run)
+                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' created (target ID = {1})".format(run.vm_name, run.vm_id), run=run)
+                else:
+                    raise Exception("No targetId in response")
+
+                start_time = datetime.datetime.utcnow()
+                self.wait_for_operation(operation['name'], run.compute, run)
+                record_operation(run, 'instanceRunning', start_time)
+
+                response = run.compute.instances().get(
+                    instance=run.vm_name,
+                    project=self.compute_config['project_id'],
+                    zone=self.compute_config['region_name'],
+                ).execute()
 
             if 'networkInterfaces' in response:
                 for ni in response['networkInterfaces']:
@@ -204,12 +336,14 @@ class GoogleConnector:
             else:
                 raise Exception("No IP address found")
 
+        except RunCancelledError:
+            raise
         except Exception as e:
             exit_client(ERR_CREATE, "Error during creation of Google VM instance: {0}".format(str(e)))
 
         # Wait for actual availability (SSH):
         connect_start_time = datetime.datetime.utcnow()
-        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run)
+        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run, self.client.ssh_ready_timeout)
 
         if available:
             run.ssh_ready_time = datetime.datetime.utcnow()
@@ -224,22 +358,31 @@ class GoogleConnector:
 
 
     def delete_vm(self, run):
+        close_ssh_connection(run)
+
         if run.vm_id is None:
             return True
 
-        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}{1}' ...".format(self.compute_config['vm_name'], run.suffix), run=run)
+        Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}' ...".format(run.vm_name), run=run)
+
+        # Virtual machines taken over from the warm pool have no client of their own
+        compute = run.compute if hasattr(run, 'compute') else self.compute
 
         max_retries = 3
         retry = 0
         deleted = False
         while retry < max_retries and not deleted:
             try:
-                operation = run.compute.instances().delete(
+                start_time = datetime.datetime.utcnow()
+                operation = compute.instances().delete(
                     project=self.compute_config['project_id'],
                     zone=self.compute_config['region_name'],
                     instance=run.vm_id
                 ).execute()
-                self.wait_for_operation(operation['name'], run.compute)
+                record_operation(run, 'deleteRequest', start_time)
+                start_time = datetime.datetime.utcnow()
+                self.wait_for_operation(operation['name'], compute, run)
+                record_operation(run, 'deleteCompleted', start_time)
 
                 Logger.log(LogLevel.INFO, "Virtual machine deleted", run=run)
                 run.delete_end_time = datetime.datetime.utcnow()
@@ -256,14 +399,50 @@ class GoogleConnector:
                     Logger.log(LogLevel.ERROR, "Delete manually", run=run)
                     print("********************************************************************", file=run.stderr)
                 else:
-                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                    time.sleep(30)
+                    interval = get_backoff_interval(retry - 1, 10, 30)
+                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after {0:.0f} seconds".format(interval), run=run)
+                    time.sleep(interval)
 
 
 
 
-    def wait_for_operation(self, operation, compute):
-        while True:
+    def get_running_instance(self, run):
+        """Returns the instance of a test run if it is running, otherwise None.
+        """
+        response = run.compute.instances().get(
+            instance=run.vm_name,
+            project=self.compute_config['project_id'],
+            zone=self.compute_config['region_name'],
+        ).execute()
+
+        if response['status'] == 'RUNNING':
+            return response
+        if response['status'] not in GoogleConnector.ADOPTABLE_STATES:
+            raise Exception("Virtual machine not starting (status: {0})".format(response['status']))
+
+        return None
+
+
+
+    def wait_for_operation(self, operation, compute, run=None):
+        """Waits until a zone operation is done.
+
+        Parameters
+        ----------
+        operation : str
+            The name of the operation.
+        compute : googleapiclient.discovery.Resource
+            The client for the compute API.
+        run : TestRun
+            The test run object encapsulating all information for an individual test run
+            (None for operations not related to a test run).
+
+        Returns
+        -------
+        dict
+            The final state of the operation.
+        """
+        def is_done():
             response = compute.zoneOperations().get(
                 project=self.compute_config['project_id'],
                 zone=self.compute_config['region_name'],
@@ -274,6 +453,8 @@ class GoogleConnector:
                     raise Exception(response['error'])
                 return response
 
-            time.sleep(1)
+            return None
+
+        return wait_for(run, is_done, "operation {0}".format(operation), GoogleConnector.OPERATION_TIMEOUT)
 
 
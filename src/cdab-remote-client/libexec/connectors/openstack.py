@@ -1,9 +1,12 @@
 from cdab_shared import *
+import base64
 import os
 import datetime
 from enum import Enum
+import openstack.connection
 import requests
 import re
+import threading
 import time
 try:
     import oathtool
@@ -12,11 +15,36 @@ except:
 
 
 class OpenStackConnector:
+    """Connector for OpenStack clouds.
+
+    All calls use one authenticated openstacksdk connection, which is shared by the threads
+    of all test runs. The IDs of images, flavours and networks are looked up once and cached.
+    """
+
+    # Maximum time (seconds) to wait for a virtual machine to become active
+    SERVER_ACTIVE_TIMEOUT = 900
+
+    # Maximum time (seconds) to wait for a volume to become available or attached (or to disappear after its deletion)
+    VOLUME_STATUS_TIMEOUT = 300
+
+    # Maximum time (seconds) to wait for a virtual machine to disappear after its deletion
+    SERVER_DELETE_TIMEOUT = 300
+
+    # Statuses of servers of an incomplete multiple-create request that are taken over by test runs
+    ADOPTABLE_STATUSES = ['BUILD', 'ACTIVE']
+
+    # Remaining validity (seconds) below which the token is renewed (two-factor authentication only)
+    TOKEN_STALE_DURATION = 900
+
 
     def __init__(self, client):
         self.client = client
         self.compute_config = self.client.compute_config
         self.ip_addresses = []
+        self.connection = None
+        self.connection_lock = threading.Lock()
+        self.resource_ids = {}
+        self.resource_lock = threading.Lock()
 
     
 
@@ -43,142 +71,171 @@ class OpenStackConnector:
         if error:
             exit_client(ERR_CONFIG, "Values missing for one or more configuration keys")
 
-        # OpenStack options that have to be used at every call
-        self.set_cloud_based_options()
-
-
-    def set_cloud_based_options(self):
-        self.cloud_base_options = [
-            '--os-auth-url', self.compute_config['auth_url'],
-            '--os-username', self.compute_config['username'],
-            '--os-password', (self.compute_config['password'], 'xxxxxxxx'),
-        ]
-        if self.compute_config['project_id']:
-            self.cloud_base_options.extend(['--os-project-id', self.compute_config['project_id']])
-        self.cloud_base_options.extend(['--os-project-name', self.compute_config['project_name']])
-
-        if self.compute_config['identity_provider']:
-            self.cloud_base_options.extend(['--os-identity-provider', self.compute_config['identity_provider']])
-        if self.compute_config['protocol']:
-            self.cloud_base_options.extend(['--os-protocol', self.compute_config['protocol']])
-        if self.compute_config['auth_type']:
-            self.cloud_base_options.extend(['--os-auth-type', self.compute_config['auth_type']])
-        if self.compute_config['project_domain_name']:
-            self.cloud_base_options.extend(['--os-project-domain-name', self.compute_config['project_domain_name']])
-        if self.compute_config['project_domain_id']:
-            self.cloud_base_options.extend(['--os-project-domain-id', self.compute_config['project_domain_id']])
-        if self.compute_config['user_domain_name']:
-            self.cloud_base_options.extend(['--os-user-domain-name', self.compute_config['user_domain_name']])
-
-        if self.compute_config['region_name']:
-            self.cloud_base_options.extend(['--os-region-name', self.compute_config['region_name']])
-        self.cloud_base_options.extend([
-            '--os-interface', self.compute_config['interface'],
-            '--os-identity-api-version', self.compute_config['identity_api_version'],
-        ])
-        if self.compute_config['volume_api_version']:
-            self.cloud_base_options.extend([
-                '--os-volume-api-version', self.compute_config['volume_api_version'],
-            ])
+        # One authenticated connection used for all calls
+        try:
+            self.connection = self.create_connection()
+        except Exception as e:
+            exit_client(ERR_CONFIG, "Authentication failed: {0}".format(str(e)))
+
+
+
+    def create_connection(self):
+        """Creates and authenticates an openstacksdk connection based on the compute configuration.
+        """
+        auth = {
+            'auth_url': self.compute_config['auth_url'],
+            'username': self.compute_config['username'],
+            'password': self.compute_config['password'],
+            'project_name': self.compute_config['project_name'],
+        }
+        for name in [
+            'project_id',
+            'project_domain_name',
+            'project_domain_id',
+            'user_domain_name',
+            'identity_provider',
+            'protocol',
+            'discovery_endpoint',
+            'client_id',
+            'client_secret',
+        ]:
+            if self.compute_config[name]:
+                auth[name] = self.compute_config[name]
 
-        if self.compute_config['discovery_endpoint']:
-            self.cloud_base_options.extend(['--os-discovery-endpoint', self.compute_config['discovery_endpoint']])
-        if self.compute_config['client_id']:
-            self.cloud_base_options.extend(['--os-client-id', self.compute_config['client_id']])
-        if self.compute_config['client_secret']:
-            self.cloud_base_options.extend(['--os-client-secret', self.compute_config['client_secret']])
+        auth_type = self.compute_config['auth_type']
 
         if self.compute_config['identity_provider_url']:
             if 'two_factor_authentication_key' in self.compute_config and self.compute_config['two_factor_authentication_key']:
+                # The access token obtained from the identity provider is exchanged for a Keystone token
                 self.get_token()
-                if 'access_token' in self.compute_config:
-                    # self.cloud_base_options.extend(['--os-access-token', compute_config['access_token']])
-                    os.environ['OS_ACCESS_TOKEN'] = self.compute_config['access_token']
-                if 'token' in self.compute_config:
-                    # self.cloud_base_options.extend(['--os-token', compute_config['token']])
-                    # os.environ['OS_TOKEN'] = compute_config['token']
-                    pass
+                auth['access_token'] = self.compute_config['access_token']
+                if not auth_type:
+                    auth_type = 'v3oidcaccesstoken'
             else:
-                self.cloud_base_options.extend(['--os-identity-provider-url', self.compute_config['identity_provider_url']])
+                auth['identity_provider_url'] = self.compute_config['identity_provider_url']
+
+        options = {
+            'auth': auth,
+            'interface': self.compute_config['interface'],
+            'identity_api_version': self.compute_config['identity_api_version'],
+        }
+        if auth_type:
+            options['auth_type'] = auth_type
+        if self.compute_config['region_name']:
+            options['region_name'] = self.compute_config['region_name']
+        if self.compute_config['volume_api_version']:
+            options['block_storage_api_version'] = self.compute_config['volume_api_version']
+
+        connection = openstack.connection.Connection(**options)
+
+        # The HTTP connection pool has to be large enough for the threads of all test runs
+        pool_size = max(10, 2 * self.client.total_vm_count)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        connection.session.session.mount('https://', adapter)
+        connection.session.session.mount('http://', adapter)
+
+        connection.authorize()
+
+        return connection
+
+
+
+    def get_connection(self):
+        """Returns the shared connection.
+
+        With two-factor authentication, the Keystone token cannot be renewed without a new
+        access token, so the connection is replaced shortly before the token expires.
+        """
+        if 'two_factor_authentication_key' in self.compute_config and self.compute_config['two_factor_authentication_key']:
+            with self.connection_lock:
+                access = self.connection.session.auth.get_access(self.connection.session)
+                if access.will_expire_soon(stale_duration=OpenStackConnector.TOKEN_STALE_DURATION):
+                    Logger.log(LogLevel.INFO, "Renewing OpenStack authentication ...")
+                    self.connection = self.create_connection()
+        return self.connection
+
+
+
+    def get_resource_id(self, resource_type, name):
+        """Returns the ID of an image, flavour or network.
+
+        The IDs do not change during an execution and are cached so that the lookup
+        is done only once for all test runs.
+
+        Parameters
+        ----------
+        resource_type : str
+            The resource type ('image', 'flavor' or 'network').
+        name : str
+            The name or ID of the resource.
+        """
+        with self.resource_lock:
+            key = (resource_type, name)
+            if key not in self.resource_ids:
+                connection = self.get_connection()
+                if resource_type == 'image':
+                    resource = connection.image.find_image(name, ignore_missing=False)
+                elif resource_type == 'flavor':
+                    resource = connection.compute.find_flavor(name, ignore_missing=False)
+                else:
+                    resource = connection.network.find_network(name, ignore_missing=False)
+                self.resource_ids[key] = resource.id
+            return self.resource_ids[key]
 
             
 
-    def delete_old_resources(self, max_retention_hours):
+    def delete_old_resources(self, max_retention_hours, keep_ids=None, pool_retention_hours=0):
         
         now = datetime.datetime.utcnow()
+        connection = self.get_connection()
 
-        # Find and delete old VMs
-        
-        options = ['openstack', 'server', 'list', '-f', 'json']
-        options.extend(self.cloud_base_options)
-        response = execute_local_command(None, options, True)
-        ids = [ r["ID"] for r in response if "ID" in r ]
+        # Find and delete old VMs (the listing contains all needed details)
         unused_vms = []
-        for id in ids:
-            try:
-                options = ['openstack', 'server', 'show', '-f', 'json']
-                options.extend(self.cloud_base_options)
-                options.append(id)
-                response = execute_local_command(None, options, True)
-                if 'name' not in response or 'created' not in response:
+        try:
+            for server in connection.compute.servers(details=True):
+                if keep_ids and server.id in keep_ids:
                     continue
-                name = response['name']
-                if not name.startswith(self.compute_config['vm_name']) or name.lower().startswith('k-'):
+                if not server.name or not server.created_at:
                     continue
-                created_time = datetime.datetime.strptime(response['created'], '%Y-%m-%dT%H:%M:%SZ')
+                retention_hours = get_retention_hours(server.name, self.compute_config['vm_name'], max_retention_hours, pool_retention_hours)
+                if retention_hours is None:
+                    continue
+                created_time = datetime.datetime.strptime(server.created_at, '%Y-%m-%dT%H:%M:%SZ')
                 time_diff = now - created_time
-                if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
-                    unused_vms.append({'id': id, 'name': name, 'created_time': created_time})
-            except Exception as e:
-                Logger.log(LogLevel.WARN, "Error while accessing information of virtual machine '{0}': {1}".format(id, str(e)))
+                if time_diff.days * 24 + time_diff.seconds // 3600 >= retention_hours:
+                    unused_vms.append({'id': server.id, 'name': server.name, 'created_time': created_time, 'retention_hours': retention_hours})
+        except Exception as e:
+            Logger.log(LogLevel.WARN, "Error while accessing information of virtual machines: {0}".format(str(e)))
 
-        if unused_vms:
-            options = ['openstack', 'server', 'delete']
-            options.extend(self.cloud_base_options)
-            options.extend(v['id'] for v in unused_vms)
-            try:
-                execute_local_command(None, options, False)
-                for v in unused_vms:
-                    Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
-                Logger.log(LogLevel.INFO, "{0} virtual machine(s) deleted".format(len(unused_vms)))
-            except Exception as e:
-                Logger.log(LogLevel.WARN, "Error during deletion of virtual machine(s): {0}".format(str(e)))
+        def delete_server(v):
+            connection.compute.delete_server(v['id'], ignore_missing=True)
+            Logger.log(LogLevel.INFO, "Virtual machine '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), v['retention_hours']))
+
+        delete_resources(unused_vms, delete_server, "virtual machine")
         
         # Find and delete old volumes
-        options = ['openstack', 'volume', 'list', '-f', 'json']
-        options.extend(self.cloud_base_options)
-        response = execute_local_command(None, options, True)
-        ids = [ r["ID"] for r in response if "ID" in r ]
         unused_volumes = []
-        for id in ids:
-            try:
-                options = ['openstack', 'volume', 'show', '-f', 'json']
-                options.extend(self.cloud_base_options)
-                options.append(id)
-                response = execute_local_command(None, options, True)
-                if 'name' not in response or 'created_at' not in response:
+        try:
+            for volume in connection.block_storage.volumes(details=True):
+                if keep_ids and volume.id in keep_ids:
+                    continue
+                if not volume.name or not volume.created_at:
                     continue
-                name = response['name']
-                if not name.startswith(self.compute_config['vm_name']):
+                retention_hours = get_retention_hours(volume.name, self.compute_config['vm_name'], max_retention_hours, pool_retention_hours)
+                if retention_hours is None:
                     continue
-                created_time = datetime.datetime.strptime(response['created_at'], '%Y-%m-%dT%H:%M:%S.%f')
+                created_time = datetime.datetime.strptime(volume.created_at, '%Y-%m-%dT%H:%M:%S.%f')
                 time_diff = now - created_time
-                if time_diff.days * 24 + time_diff.seconds // 3600 >= max_retention_hours:
-                    unused_volumes.append({'id': id, 'name': name, 'created_time': created_time})
-            except Exception as e:
-                Logger.log(LogLevel.WARN, "Error while accessing information of virtual machine '{0}': {1}".format(id, str(e)))
+                if time_diff.days * 24 + time_diff.seconds // 3600 >= retention_hours:
+                    unused_volumes.append({'id': volume.id, 'name': volume.name, 'created_time': created_time, 'retention_hours': retention_hours})
+        except Exception as e:
+            Logger.log(LogLevel.WARN, "Error while accessing information of volumes: {0}".format(str(e)))
 
-        if unused_volumes:
-            options = ['openstack', 'volume', 'delete']
-            options.extend(self.cloud_base_options)
-            options.extend([v['id'] for v in unused_volumes])
-            try:
-                execute_local_command(None, options, False)
-                for v in unused_volumes:
-                    Logger.log(LogLevel.INFO, "Volume '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), max_retention_hours))
-                Logger.log(LogLevel.INFO, "{0} volume(s) deleted".format(len(unused_volumes)))
-            except Exception as e:
-                Logger.log(LogLevel.WARN, "Error during deletion of volume(s): {0}".format(str(e)))
+        def delete_volume(v):
+            connection.block_storage.delete_volume(v['id'], ignore_missing=True)
+            Logger.log(LogLevel.INFO, "Volume '{0}' (ID: '{1}') deleted (created on {2}, more than {3} hours ago)".format(v['name'], v['id'], v['created_time'].strftime('%Y-%m-%dT%H:%M:%S.%fZ'), v['retention_hours']))
+
+        delete_resources(unused_volumes, delete_volume, "volume")
 
 
 
@@ -201,67 +258,145 @@ class OpenStackConnector:
 
 
 
+    def get_server_attributes(self, run):
+        """Returns the attributes for the creation request of the virtual machine of a test run.
+        """
+        # Names are resolved (from the cache) before the creation request is timed
+        attributes = {
+            'name': run.vm_name,
+            'image_id': self.get_resource_id('image', self.compute_config['image_name']),
+            'flavor_id': self.get_resource_id('flavor', run.flavor),
+            'key_name': self.compute_config['key_name'],
+        }
+        if self.compute_config['network_name']:
+            attributes['networks'] = [ {'uuid': self.get_resource_id('network', n)} for n in self.compute_config['network_name'] ]
+        if self.compute_config['security_group']:
+            attributes['security_groups'] = [ {'name': self.compute_config['security_group']} ]
+
+        # Software installation via cloud-init, if configured
+        user_data = self.client.get_user_data(run)
+        if user_data:
+            attributes['user_data'] = base64.b64encode(user_data.encode('utf-8')).decode('ascii')
+
+        return attributes
+
+
+
+    def create_vms(self, runs):
+        """Requests the virtual machines of several test runs (with the same flavour) with a single
+        multiple-create call; the servers are named by the compute service after a common base name
+        and assigned to the test runs in the order of their names. The creation is completed for
+        each test run by create_vm.
+
+        If the request failed on the client side (e.g. because of a timeout), but may have been accepted
+        by the compute service, the servers that exist nevertheless are taken over by the test runs if they
+        are being built or active, and deleted otherwise; the remaining virtual machines are created individually.
+
+        Parameters
+        ----------
+        runs : list of TestRun
+            The test run objects (the first provides the user data).
+        """
+        attributes = self.get_server_attributes(runs[0])
+        base_name = "{0}-{1}-b{2}".format(self.compute_config['vm_name'], self.client.random_sequence, runs[0].index + 1)
+        attributes['name'] = base_name
+        attributes['min_count'] = len(runs)
+        attributes['max_count'] = len(runs)
+
+        connection = self.get_connection()
+
+        create_start_time = datetime.datetime.utcnow()
+        for run in runs:
+            run.create_start_time = create_start_time
+        complete = True
+        try:
+            connection.compute.create_server(**attributes)
+            for run in runs:
+                record_operation(run, 'createRequest', create_start_time)
+        except Exception as e:
+            complete = False
+            Logger.log(LogLevel.WARN, "Bulk creation of virtual machines incomplete: {0}".format(str(e)), run=runs[0])
+
+        servers = [s for s in connection.compute.servers(name="^{0}".format(base_name)) if s.name.startswith(base_name)]
+        servers.sort(key=lambda s: (len(s.name), s.name))
+
+        if not complete:
+            for server in [s for s in servers if s.status not in OpenStackConnector.ADOPTABLE_STATUSES]:
+                Logger.log(LogLevel.WARN, "Deleting virtual machine '{0}' from incomplete bulk creation (status: {1}) ...".format(server.name, server.status), run=runs[0])
+                try:
+                    connection.compute.delete_server(server.id, ignore_missing=True)
+                except Exception as e:
+                    self.client.incomplete_deletion = True
+                    Logger.log(LogLevel.ERROR, "Failed to delete virtual machine '{0}' (delete manually): {1}".format(server.id, str(e)), run=runs[0])
+            servers = [s for s in servers if s.status in OpenStackConnector.ADOPTABLE_STATUSES]
+
+        for (run, server) in zip(runs, servers):
+            if not complete:
+                record_operation(run, 'createRequest', create_start_time)
+            run.vm_id = server.id
+            run.vm_name = server.name
+            run.bulk_created = True
+            Logger.log(LogLevel.INFO, "Virtual machine '{0}' created in bulk (name: {1})".format(run.vm_id, run.vm_name), run=run)
+            self.client.update_journal(run)
+
+        if complete and len(servers) < len(runs):
+            raise Exception("Only {0} of {1} virtual machines found after bulk creation".format(len(servers), len(runs)))
+
+
+
     def create_vm(self, run):
 
-        Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
+        connection = self.get_connection()
 
-        options = ['openstack', 'server', 'create', '--wait', '-f', 'json']
-        options.extend(self.cloud_base_options)
-        options.extend([
-            '--image', self.compute_config['image_name'],
-            '--flavor', run.flavor
-        ])
-        if self.compute_config['network_name']:
-            for network_name in self.compute_config['network_name']:
-                options.extend(['--network', network_name])
-        if self.compute_config['security_group']:
-            options.extend(['--security-group', self.compute_config['security_group']])
-        options.extend([
-            '--key-name', self.compute_config['key_name'],
-            "{0}{1}".format(self.compute_config['vm_name'], run.suffix)
-        ])
+        if run.bulk_created:
+            Logger.log(LogLevel.INFO, "Waiting for virtual machine created in bulk ...", run=run)
+        else:
+            Logger.log(LogLevel.INFO, "Creating virtual machine ...", run=run)
 
-        run.create_start_time = datetime.datetime.utcnow()
-        response = execute_local_command(run, options, True)
+            attributes = self.get_server_attributes(run)
 
-        Logger.log(LogLevel.DEBUG, response, run=run)
+            run.create_start_time = datetime.datetime.utcnow()
+            server = connection.compute.create_server(**attributes)
+            record_operation(run, 'createRequest', run.create_start_time)
 
-        if 'id' in response and response['id']:
-            run.vm_id = response['id']
-            Logger.log(LogLevel.INFO, "Virtual machine '{0}' created".format(run.vm_id), run=run)
+            if server.id:
+                run.vm_id = server.id
+                Logger.log(LogLevel.INFO, "Virtual machine '{0}' created".format(run.vm_id), run=run)
+                self.client.update_journal(run)
 
-        if run.vm_id is None:
-            raise Exception("No virtual machine ID found")
+            if run.vm_id is None:
+                raise Exception("No virtual machine ID found")
+
+        start_time = datetime.datetime.utcnow()
+        server = self.wait_for_status(run, lambda: connection.compute.get_server(run.vm_id), 'ACTIVE', OpenStackConnector.SERVER_ACTIVE_TIMEOUT, "virtual machine", initial_interval=2)
+        record_operation(run, 'instanceRunning', start_time)
+
+        Logger.log(LogLevel.DEBUG, server.addresses, run=run)
 
         if self.compute_config['floating_ip']:
+            start_time = datetime.datetime.utcnow()
             self.assign_floating_ip(run)
-        elif 'addresses' in response:
-            addresses = response['addresses']
-            if isinstance(addresses, dict):
-                if self.compute_config['floating_ip_network'] and self.compute_config['floating_ip_network'] in addresses and len(self.compute_config['floating_ip_network']) != 0:
-                    run.public_ip = self.compute_config['floating_ip_network'][0]
-                else:
-                    all_ips = [v for k in addresses for v in addresses[k]]
-                    ip = next((v for v in all_ips if not v.startswith("10.") and not v.startswith("192.")), None)
-                    if ip:
-                        run.public_ip = ip
-                    else:
-                        raise Exception("No IP address found among: {0}".format(', '.join(all_ips)))
-
+            record_operation(run, 'ipAssigned', start_time)
+        else:
+            addresses = server.addresses if server.addresses else {}
+            floating_ip_network = self.compute_config['floating_ip_network']
+            if floating_ip_network and floating_ip_network in addresses and addresses[floating_ip_network]:
+                run.public_ip = addresses[floating_ip_network][0]['addr']
             else:
-                ip_match = re.match(r".*(, |=)((\d{1,3}\.\d{1,3})\.\d{1,3}\.\d{1,3}).*", addresses)
-                if ip_match:
-                    run.public_ip = ip_match[2]
-                    Logger.log(LogLevel.INFO, "IP address {0} assigned automatically at creation".format(run.public_ip), run=run)
-
-                if run.public_ip is None:
-                    raise Exception("No IP address found: {0}".format(response['addresses']))
-                    return False
+                all_addresses = [a for k in addresses for a in addresses[k]]
+                ip = next((a['addr'] for a in all_addresses if a.get('OS-EXT-IPS:type') == 'floating'), None)
+                if ip is None:
+                    ip = next((a['addr'] for a in all_addresses if not a['addr'].startswith("10.") and not a['addr'].startswith("192.")), None)
+                if ip:
+                    run.public_ip = ip
+                else:
+                    raise Exception("No IP address found among: {0}".format(', '.join([a['addr'] for a in all_addresses])))
+            Logger.log(LogLevel.INFO, "IP address {0} assigned automatically at creation".format(run.public_ip), run=run)
 
 
         # Wait for actual availability (SSH):
         connect_start_time = datetime.datetime.utcnow()
-        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run)
+        available = await_vm_availability(self.compute_config, self.client.connect_retries, self.client.connect_interval, run, self.client.ssh_ready_timeout)
 
         if available:
             run.ssh_ready_time = datetime.datetime.utcnow()
@@ -272,75 +407,8 @@ class OpenStackConnector:
         if available and (self.compute_config['use_volume'] or self.compute_config['use_tmp_volume']):
             if self.compute_config['use_volume']:
                 Logger.log(LogLevel.INFO, "Creating main volume for virtual machine ...", run=run)
-                options = ['openstack', 'volume', 'create', '-f', 'json']
-                options.extend(self.cloud_base_options)
-                options.extend([
-                    "--size", "100",
-                    "{0}{1}-volume".format(self.compute_config['vm_name'], run.suffix)
-                ])
-                response = execute_local_command(run, options, True)
-
-                if 'id' in response and response['id']:
-                    run.volume_id = response['id']
-                    Logger.log(LogLevel.INFO, "Volume '{0}' created".format(run.volume_id), run=run)
-
-                if run.volume_id is None:
-                    raise Exception("No volume found for volume")
-
-                Logger.log(LogLevel.INFO, "Attaching volume to virtual machine ...", run=run)
-                options = ['openstack', 'server', 'add', 'volume']
-                options.extend(self.cloud_base_options)
-                options.extend([
-                    run.vm_id,
-                    run.volume_id,
-                ])
-                execute_local_command(run, options, False)
-
-            if self.compute_config['use_tmp_volume']:
-                Logger.log(LogLevel.INFO, "Creating /tmp volume for virtual machine ...", run=run)
-                options = ['openstack', 'volume', 'create', '-f', 'json']
-                options.extend(self.cloud_base_options)
-                options.extend([
-                    "--size", "50",
-                    "{0}{1}-tmp-volume".format(self.compute_config['vm_name'], run.suffix)
-                ])
-                response = execute_local_command(run, options, True)
-
-                if 'id' in response and response['id']:
-                    run.tmp_volume_id = response['id']
-                    Logger.log(LogLevel.INFO, "Volume '{0}' created".format(run.tmp_volume_id), run=run)
-
-                if run.tmp_volume_id is None:
-                    raise Exception("No ID found for /tmp volume")
-
-                Logger.log(LogLevel.INFO, "Attaching volume to virtual machine ...", run=run)
-                options = ['openstack', 'server', 'add', 'volume']
-                options.extend(self.cloud_base_options)
-                options.extend([
-                    run.vm_id,
-                    run.tmp_volume_id,
-                ])
-                execute_local_command(run, options, False)
-
-            time.sleep(15)
-
-            options = ['openstack', 'volume', 'list', '-f', 'json']
-            options.extend(self.cloud_base_options)
-            response = execute_local_command(run, options, True)
-
-            if self.compute_config['use_volume']:
-                volume_node = next((r for r in response if r['ID'] == run.volume_id), None)
-
-                if volume_node and 'Attached to' in volume_node and volume_node['Attached to']:
-                    if isinstance(volume_node['Attached to'], list):
-                        for a in volume_node['Attached to']:
-                            if 'server_id' in a and 'device' in a and a['server_id'] == run.vm_id:
-                                run.volume_device = a['device']
-                                break
-                    else:
-                        device_match = re.match(r".* on (/dev/[^ ]+).*", volume_node['Attached to'])
-                        if device_match:
-                            run.volume_device = device_match[1]
+                run.volume_id = self.create_volume(run, 100, "{0}-volume".format(run.vm_name))
+                run.volume_device = self.attach_volume(run, run.volume_id)
 
                 if run.volume_device is None:
                     raise Exception("No volume device found (main volume)")
@@ -348,18 +416,9 @@ class OpenStackConnector:
                 run.volume_attached = True
 
             if self.compute_config['use_tmp_volume']:
-                volume_node = next((r for r in response if r['ID'] == run.tmp_volume_id), None)
-
-                if volume_node and 'Attached to' in volume_node and volume_node['Attached to']:
-                    if isinstance(volume_node['Attached to'], list):
-                        for a in volume_node['Attached to']:
-                            if 'server_id' in a and 'device' in a and a['server_id'] == run.vm_id:
-                                run.tmp_volume_device = a['device']
-                                break
-                    else:
-                        device_match = re.match(r".* on (/dev/[^ ]+).*", volume_node['Attached to'])
-                        if device_match:
-                            run.tmp_volume_device = device_match[1]
+                Logger.log(LogLevel.INFO, "Creating /tmp volume for virtual machine ...", run=run)
+                run.tmp_volume_id = self.create_volume(run, 50, "{0}-tmp-volume".format(run.vm_name))
+                run.tmp_volume_device = self.attach_volume(run, run.tmp_volume_id)
 
                 if run.tmp_volume_device is None:
                     raise Exception("No volume device found (/tmp volume)")
@@ -401,109 +460,125 @@ class OpenStackConnector:
 
 
 
+    def create_volume(self, run, size, name):
+        """Creates a volume and waits until it is available.
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        size : int
+            The volume size in GB.
+        name : str
+            The volume name.
+
+        Returns
+        -------
+        str
+            The volume ID.
+        """
+        connection = self.get_connection()
+        start_time = datetime.datetime.utcnow()
+        volume = connection.block_storage.create_volume(size=size, name=name)
+
+        if not volume.id:
+            raise Exception("No ID found for volume '{0}'".format(name))
+
+        Logger.log(LogLevel.INFO, "Volume '{0}' created".format(volume.id), run=run)
+
+        self.wait_for_status(run, lambda: connection.block_storage.get_volume(volume.id), 'available', OpenStackConnector.VOLUME_STATUS_TIMEOUT, "volume")
+        record_operation(run, 'volumeCreated', start_time)
+
+        return volume.id
+
+
+
+    def attach_volume(self, run, volume_id):
+        """Attaches a volume to the virtual machine of a test run and waits until it is in use.
+
+        Returns
+        -------
+        str
+            The device name of the attached volume (as reported by the API).
+        """
+        # The volume ID is recorded before attaching so that the volume can be deleted on resumption
+        self.client.update_journal(run)
+
+        Logger.log(LogLevel.INFO, "Attaching volume to virtual machine ...", run=run)
+        connection = self.get_connection()
+        start_time = datetime.datetime.utcnow()
+        attachment = connection.compute.create_volume_attachment(run.vm_id, volume_id=volume_id)
+        volume = self.wait_for_status(run, lambda: connection.block_storage.get_volume(volume_id), 'in-use', OpenStackConnector.VOLUME_STATUS_TIMEOUT, "volume")
+        record_operation(run, 'volumeAttached', start_time)
+
+        if attachment.device:
+            return attachment.device
+
+        return next((a['device'] for a in (volume.attachments or []) if a.get('server_id') == run.vm_id and 'device' in a), None)
+
+
+
+    def wait_for_status(self, run, get_resource, status, timeout, description, initial_interval=1):
+        """Polls a virtual machine or volume until it has the given status.
+
+        Parameters
+        ----------
+        run : TestRun
+            The test run object encapsulating all information for an individual test run.
+        get_resource : function
+            A function returning the current state of the resource.
+        status : str
+            The expected status.
+        timeout : int
+            The maximum time to wait (seconds).
+        description : str
+            The type of resource (for messages).
+        initial_interval : float
+            The interval between the first status checks (seconds), increasing with each check.
+
+        Returns
+        -------
+        The resource with the expected status.
+        """
+        def has_status():
+            resource = get_resource()
+            if resource.status and resource.status.lower() == 'error':
+                raise Exception("The {0} '{1}' is in error status".format(description, resource.id))
+            return resource if resource.status == status else None
+
+        return wait_for(run, has_status, "{0} {1}".format(description, status.lower()), timeout, initial_interval=initial_interval)
+
+
+
 
     def delete_vm(self, run):
+        close_ssh_connection(run)
+
         if run.vm_id is None:
             return True
 
-        self.set_cloud_based_options()
-
-        max_retries = 3
         if self.compute_config['use_volume'] and run.volume_id and run.volume_attached:
             Logger.log(LogLevel.INFO, "Detaching main volume from virtual machine ...", run=run)
-            options = ['openstack', 'server', 'remove', 'volume']
-            options.extend(self.cloud_base_options)
-            options.extend([
-                run.vm_id,
-                run.volume_id,
-            ])
-            execute_local_command(run, options, False)
-            time.sleep(10)
-
-            Logger.log(LogLevel.INFO, "Deleting volume {0} ...".format(run.volume_id), run=run)
-            options = ['openstack', 'volume', 'delete']
-            options.extend(self.cloud_base_options)
-            options.extend([
-                run.volume_id,
-            ])
-            
-            retry = 0
-            deleted = False
-            while retry < max_retries and not deleted:
-                try:
-                    execute_local_command(run, options, False)
-                    run.delete_end_time = datetime.datetime.utcnow()
-                    Logger.log(LogLevel.INFO, "Volume deleted", run=run)
-                    deleted = True
-                except Exception as e:
-                    retry += 1
-
-                    if retry == max_retries:
-                        self.client.incomplete_deletion = True
-                        print("********************************************************************", file=run.stderr)
-                        Logger.log(LogLevel.ERROR, "Failed to delete volume '{0}'".format(run.volume_id), run=run)
-                        Logger.log(LogLevel.ERROR, "Message: {0}".format(str(e)), run=run)
-                        Logger.log(LogLevel.ERROR, "Delete manually", run=run)
-                        print("********************************************************************", file=run.stderr)
-                    else:
-                        Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                        time.sleep(30)
-
+            self.delete_volume(run, run.volume_id)
 
         if self.compute_config['use_tmp_volume'] and run.tmp_volume_id and run.tmp_volume_attached:
             Logger.log(LogLevel.INFO, "Detaching /tmp volume from virtual machine ...", run=run)
-            options = ['openstack', 'server', 'remove', 'volume']
-            options.extend(self.cloud_base_options)
-            options.extend([
-                run.vm_id,
-                run.tmp_volume_id,
-            ])
-            execute_local_command(run, options, False)
-            time.sleep(10)
-
-            Logger.log(LogLevel.INFO, "Deleting volume {0} ...".format(run.volume_id), run=run)
-            options = ['openstack', 'volume', 'delete']
-            options.extend(self.cloud_base_options)
-            options.extend([
-                run.tmp_volume_id,
-            ])
-            
-            retry = 0
-            deleted = False
-            while retry < max_retries and not deleted:
-                try:
-                    execute_local_command(run, options, False)
-                    run.delete_end_time = datetime.datetime.utcnow()
-                    Logger.log(LogLevel.INFO, "Volume deleted", run=run)
-                    deleted = True
-                except Exception as e:
-                    retry += 1
-
-                    if retry == max_retries:
-                        self.client.incomplete_deletion = True
-                        print("********************************************************************", file=run.stderr)
-                        Logger.log(LogLevel.ERROR, "Failed to delete volume '{0}'".format(run.tmp_volume_id), run=run)
-                        Logger.log(LogLevel.ERROR, "Message: {0}".format(str(e)), run=run)
-                        Logger.log(LogLevel.ERROR, "Delete manually", run=run)
-                        print("********************************************************************", file=run.stderr)
-                    else:
-                        Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                        time.sleep(30)
-
+            self.delete_volume(run, run.tmp_volume_id)
 
         Logger.log(LogLevel.INFO, "Deleting virtual machine '{0}' ...".format(run.vm_id), run=run)
 
-        options = ['openstack', 'server', 'delete']
-        options.extend(self.cloud_base_options)
-        options.extend([
-            run.vm_id
-        ])
-
+        max_retries = 3
         retry = 0
         deleted = False
         while retry < max_retries and not deleted:
             try:
-                execute_local_command(run, options, False)
+                connection = self.get_connection()
+                start_time = datetime.datetime.utcnow()
+                connection.compute.delete_server(run.vm_id, ignore_missing=True)
+                record_operation(run, 'deleteRequest', start_time)
+                start_time = datetime.datetime.utcnow()
+                wait_for(run, lambda: connection.compute.find_server(run.vm_id) is None, "virtual machine deleted", OpenStackConnector.SERVER_DELETE_TIMEOUT, initial_interval=2)
+                record_operation(run, 'deleteCompleted', start_time)
                 run.delete_end_time = datetime.datetime.utcnow()
                 Logger.log(LogLevel.INFO, "Virtual machine deleted", run=run)
                 deleted = True
@@ -518,28 +593,82 @@ class OpenStackConnector:
                     Logger.log(LogLevel.ERROR, "Delete manually", run=run)
                     print("********************************************************************", file=run.stderr)
                 else:
-                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after 30 seconds", run=run)
-                    time.sleep(30)
+                    interval = get_backoff_interval(retry - 1, 10, 30)
+                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after {0:.0f} seconds".format(interval), run=run)
+                    time.sleep(interval)
 
 
         return not self.client.incomplete_deletion
 
 
 
+    def delete_volume(self, run, volume_id):
+        """Detaches a volume from the virtual machine of a test run and deletes it.
+        """
+        connection = self.get_connection()
+        start_time = datetime.datetime.utcnow()
+        try:
+            connection.compute.delete_volume_attachment(run.vm_id, volume_id, ignore_missing=True)
+            self.wait_for_status(run, lambda: connection.block_storage.get_volume(volume_id), 'available', OpenStackConnector.VOLUME_STATUS_TIMEOUT, "volume")
+        except Exception as e:
+            Logger.log(LogLevel.WARN, "Detaching volume failed: {0}".format(str(e)), run=run)
+
+        Logger.log(LogLevel.INFO, "Deleting volume {0} ...".format(volume_id), run=run)
+
+        # The volume is only deleted when it is no longer found (as for the virtual machine)
+        def is_deleted():
+            volume = connection.block_storage.find_volume(volume_id)
+            if volume is None or volume.status == 'deleted':
+                return True
+            if volume.status == 'error_deleting':
+                raise Exception("Volume status: error_deleting")
+            return False
+
+        max_retries = 3
+        retry = 0
+        deleted = False
+        while retry < max_retries and not deleted:
+            try:
+                connection.block_storage.delete_volume(volume_id, ignore_missing=True)
+                wait_for(run, is_deleted, "volume deleted", OpenStackConnector.VOLUME_STATUS_TIMEOUT, initial_interval=2)
+                record_operation(run, 'volumeDeleted', start_time)
+                run.delete_end_time = datetime.datetime.utcnow()
+                Logger.log(LogLevel.INFO, "Volume deleted", run=run)
+                deleted = True
+            except Exception as e:
+                retry += 1
+
+                if retry == max_retries:
+                    self.client.incomplete_deletion = True
+                    print("********************************************************************", file=run.stderr)
+                    Logger.log(LogLevel.ERROR, "Failed to delete volume '{0}'".format(volume_id), run=run)
+                    Logger.log(LogLevel.ERROR, "Message: {0}".format(str(e)), run=run)
+                    Logger.log(LogLevel.ERROR, "Delete manually", run=run)
+                    print("********************************************************************", file=run.stderr)
+                else:
+                    interval = get_backoff_interval(retry - 1, 10, 30)
+                    Logger.log(LogLevel.WARN, "Deletion failed, retrying after {0:.0f} seconds".format(interval), run=run)
+                    time.sleep(interval)
+
+
+
     def assign_floating_ip(self, run):
 
         Logger.log(LogLevel.INFO, "Assigning floating IP address ...", run=run)
 
         if run.index >= len(self.ip_addresses):
-            Logger.log(LogLevel.ERROR, "No IP address available", run=run)
+            raise Exception("No floating IP address available")
 
         ip_address = self.ip_addresses[run.index]
 
-        options = ['openstack', 'server', 'add', 'floating ip']
-        options.extend(self.cloud_base_options)
-        options.extend([run.vm_id, ip_address])
+        # The floating IP address is associated with the port of the virtual machine
+        connection = self.get_connection()
+        floating_ip = next(connection.network.ips(floating_ip_address=ip_address), None)
+        port = next(connection.network.ports(device_id=run.vm_id), None)
+        if floating_ip is None or port is None:
+            raise Exception("Floating IP address {0} or port of virtual machine not found".format(ip_address))
 
-        response = execute_local_command(run, options, False)
+        connection.network.update_ip(floating_ip, port_id=port.id)
         run.public_ip = ip_address
 
         Logger.log(LogLevel.INFO, "IP address {0} assigned explicitly".format(run.public_ip), run=run)
@@ -549,14 +678,11 @@ class OpenStackConnector:
     def find_floating_ips(self, number_needed):
         Logger.log(LogLevel.INFO, "Obtaining list of available floating IP addresses ...")
 
-        options = ['openstack', 'floating ip', 'list', '-f', 'json']
-        options.extend(self.cloud_base_options)
+        filters = {}
         if self.compute_config['floating_ip_network']:
-            options.extend(['--network', self.compute_config['floating_ip_network']])
+            filters['floating_network_id'] = self.get_resource_id('network', self.compute_config['floating_ip_network'])
 
-        response = execute_local_command(None, options, True)
-
-        self.ip_addresses = [r['Floating IP Address'] for r in response if r['Fixed IP Address'] is None]
+        self.ip_addresses = [ip.floating_ip_address for ip in self.get_connection().network.ips(**filters) if ip.fixed_ip_address is None]
 
         if self.ip_addresses == []:
             exit_client(ERR_CREATE, "No floating IP address available")
@@ -593,19 +719,7 @@ class OpenStackConnector:
         if 'access_token' in content:
             self.compute_config['access_token'] = content['access_token']
         else:
-            Logger.log(LogLevel.ERROR, "Cannot obtain Keycloak token (OS_ACCESS_TOKEN)")
-            return
-
-        options = ['openstack', 'token', 'issue', '-f', 'json', '-c', 'id']
-        options.extend(self.cloud_base_options)
-        options.extend(['--os-access-token', self.compute_config['access_token']])
-        response = execute_local_command(None, options, True)
-
-        if 'id' in response:
-            self.compute_config['token'] = response['id']
-        else:
-            Logger.log(LogLevel.ERROR, "Cannot obtain Keystone token (OS_TOKEN)")
-            return
+            raise Exception("Cannot obtain Keycloak token (OS_ACCESS_TOKEN)")
 
 
 
@@ -0,0 +1,19 @@
+# Runs a test scenario script and records its process ID, exit code and
+# start and end time (nanoseconds since the epoch) in a status file,
+# which is written atomically once the script has finished.
+#
+# Usage: run-wrapper.sh <status-file> <command> [<argument> ...]
+
+status_file="$1"
+shift
+
+rm -f "${status_file}" "${status_file}.tmp"
+echo $$ > "${status_file}.pid"
+
+start_time=$(date +%s%N)
+"$@"
+exit_code=$?
+end_time=$(date +%s%N)
+
+echo "{\"exitCode\": ${exit_code}, \"startTime\": ${start_time}, \"endTime\": ${end_time}}" > "${status_file}.tmp"
+mv "${status_file}.tmp" "${status_file}"